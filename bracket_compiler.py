@@ -0,0 +1,91 @@
+## Compiles a bracket definition (brackets/*.json) plus a ratings table into per-round index arrays
+
+import json
+import os
+import numpy as np
+
+DEFAULT_BRACKET_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'brackets', 'ncaa.json')
+
+## A bracket config lists
+##   regions - region names in bracket order, adjacent regions meet in the semifinals
+##   region_seeds - seeds in bracket order down one region, adjacent seeds meet in the first round
+##   round_names - result column for winning each round, ending with the title game
+##   play_in_round_name - result column for the play-in round, used when a (region, seed) slot has two teams
+
+def load_bracket_config(bracket = None):
+    ## Accepts a config path, an already loaded dict, or None for the default NCAA bracket
+    if isinstance(bracket, dict):
+        return bracket
+    with open(bracket or DEFAULT_BRACKET_CONFIG) as file:
+        return json.load(file)
+
+class CompiledBracket:
+
+    def __init__(self, rounds, round_names, n_teams) -> None:
+        ## rounds[0] pairs team rows directly, rounds[r] for r > 0 pairs positions in round r - 1's list of winners
+        self.rounds = rounds
+        self.round_names = round_names
+        self.n_teams = n_teams
+
+    @property
+    def n_games(self):
+        return sum(len(left) for left, _ in self.rounds)
+
+    def round_offsets(self):
+        ## Game number of the first game in each round, plus the total, when games are numbered round by round
+        return np.cumsum([0] + [len(left) for left, _ in self.rounds])
+
+    def flat_games(self):
+        ## (left, right) for every game numbered round by round - first round entries are team rows,
+        ## later entries are the game numbers whose winners meet
+        offsets = self.round_offsets()
+        lefts = [self.rounds[0][0]]
+        rights = [self.rounds[0][1]]
+        for r in range(1, len(self.rounds)):
+            lefts.append(self.rounds[r][0] + offsets[r - 1])
+            rights.append(self.rounds[r][1] + offsets[r - 1])
+        return np.concatenate(lefts).astype(np.intp), np.concatenate(rights).astype(np.intp)
+
+def compile_bracket(config, teams_df):
+    regions = teams_df['Region'].to_numpy()
+    seeds = teams_df['Seed'].to_numpy()
+    unknown_regions = set(regions) - set(config['regions'])
+    if unknown_regions:
+        raise ValueError(f'Regions {sorted(unknown_regions)} are not in bracket {config["name"]!r}')
+
+    ## Team rows for every (region, seed) slot in bracket order - two rows means a play-in game
+    slots = []
+    for region in config['regions']:
+        for seed in config['region_seeds']:
+            rows = np.flatnonzero((regions == region) & (seeds == seed))
+            if len(rows) not in (1, 2):
+                raise ValueError(f'Expected 1 or 2 teams for {region} seed {seed}, found {len(rows)}')
+            slots.append(rows)
+
+    n_slots = len(slots)
+    if n_slots & (n_slots - 1):
+        raise ValueError(f'Bracket {config["name"]!r} has {n_slots} slots, expected a power of two')
+    if sum(len(rows) for rows in slots) != len(teams_df):
+        raise ValueError(f'{len(teams_df)} teams in the ratings table but bracket {config["name"]!r} only places some of them')
+
+    rounds = []
+    round_names = list(config['round_names'])
+    if any(len(rows) == 2 for rows in slots):
+        ## Play-in round - teams without a play-in game get a bye, drawn as a game against themselves
+        left = np.array([rows[0] for rows in slots])
+        right = np.array([rows[-1] for rows in slots])
+        rounds.append((left, right))
+        round_names.insert(0, config['play_in_round_name'])
+        first_round = np.arange(n_slots)
+    else:
+        first_round = np.array([rows[0] for rows in slots])
+    rounds.append((first_round[0::2], first_round[1::2]))
+
+    n_games = n_slots // 2
+    while n_games > 1:
+        rounds.append((np.arange(0, n_games, 2), np.arange(1, n_games, 2)))
+        n_games //= 2
+
+    if len(rounds) != len(round_names):
+        raise ValueError(f'Bracket {config["name"]!r} has {len(rounds)} rounds but names {round_names}')
+    return CompiledBracket(rounds, round_names, len(teams_df))
@@ -0,0 +1,122 @@
+## Searches for the pool bracket with the best expected score or the best chance of winning a pool of size K
+
+import numpy as np
+
+OBJECTIVES = ['expected', 'pool']
+
+class BracketOptimizer:
+
+    def __init__(self, pool, outcomes, objective = 'expected', pool_size = 10, opponent_picks = None, seed = None) -> None:
+        ## pool is a BracketPool (game layout and scoring), outcomes a (sims x games) array of simulated brackets
+        ## For objective = 'pool' the other pool_size - 1 entries are opponent_picks, or simulated brackets by default
+        if objective not in OBJECTIVES:
+            raise ValueError(f'Unknown objective {objective!r}, expected one of {OBJECTIVES}')
+        self.pool = pool
+        self.objective = objective
+        self.rng = np.random.default_rng(seed)
+        outcomes = np.asarray(outcomes)
+
+        ## Cached tournaments as wins per team - team t won its round r game in sim s exactly when wins[s, t] > r,
+        ## so any pick can be scored against every simulation without touching the raw outcomes again
+        self.wins = np.zeros((len(outcomes), pool.n_teams), dtype = np.uint8)
+        rows = np.arange(len(outcomes))[:, None]
+        for r in range(pool.n_rounds):
+            self.wins[rows, outcomes[:, pool.round_offsets[r]:pool.round_offsets[r + 1]]] += 1
+
+        self.parent = np.full(pool.n_games, -1)
+        first_round_games = pool.round_offsets[1]
+        self.parent[pool.game_lefts[first_round_games:]] = np.arange(first_round_games, pool.n_games)
+        self.parent[pool.game_rights[first_round_games:]] = np.arange(first_round_games, pool.n_games)
+        self.game_points = pool.round_points[pool.game_round]
+
+        if objective == 'pool':
+            if opponent_picks is None:
+                opponent_picks = outcomes[self.rng.choice(len(outcomes), pool_size - 1, replace = False)]
+            self.opponent_best = pool.score(opponent_picks, outcomes).max(axis = 0)
+
+    def game_scores(self, game, team):
+        ## Points per simulation for picking team to win game
+        return self.game_points[game] * (self.wins[:, team] > self.pool.game_round[game])
+
+    def scores(self, picks):
+        return sum(self.game_scores(game, team) for game, team in enumerate(picks))
+
+    def evaluate(self, scores):
+        if self.objective == 'expected':
+            return scores.mean()
+        ## Chance of finishing first, splitting ties
+        return np.mean((scores > self.opponent_best) + 0.5 * (scores == self.opponent_best))
+
+    def flip(self, picks, game):
+        ## Give game to the other team that can arrive there, and carry the new team through every later game the
+        ## old one was picked to win. Returns the changed games as (game, old team, new team).
+        old_team = picks[game]
+        if game < self.pool.round_offsets[1]:
+            options = (self.pool.game_lefts[game], self.pool.game_rights[game])
+        else:
+            options = (picks[self.pool.game_lefts[game]], picks[self.pool.game_rights[game]])
+        new_team = options[1] if options[0] == old_team else options[0]
+
+        changes = []
+        while game >= 0 and picks[game] == old_team and new_team != old_team:
+            changes.append((game, old_team, new_team))
+            game = self.parent[game]
+        return changes
+
+    def move_delta(self, changes):
+        ## Incremental rescoring - only the changed games are looked up, not the whole bracket
+        delta = 0
+        for game, old_team, new_team in changes:
+            delta = delta + self.game_scores(game, new_team) - self.game_scores(game, old_team)
+        return delta
+
+    def apply(self, picks, changes):
+        for game, _, new_team in changes:
+            picks[game] = new_team
+
+    def greedy(self, picks, max_steps = 1000):
+        ## Hill climb - take the single best flip until none improves the objective
+        picks = self.pool.validate_picks(picks)[0].copy()
+        scores = self.scores(picks)
+        value = self.evaluate(scores)
+        for _ in range(max_steps):
+            best = None
+            for game in range(self.pool.n_games):
+                changes = self.flip(picks, game)
+                if not changes:
+                    continue
+                new_scores = scores + self.move_delta(changes)
+                new_value = self.evaluate(new_scores)
+                if new_value > value and (best is None or new_value > best[0]):
+                    best = (new_value, new_scores, changes)
+            if best is None:
+                break
+            value, scores, changes = best
+            self.apply(picks, changes)
+        return picks, value
+
+    def anneal(self, picks, n_steps = 20000, start_temp = None, end_temp = None):
+        ## Simulated annealing over random flips with geometric cooling, returning the best bracket seen
+        picks = self.pool.validate_picks(picks)[0].copy()
+        scores = self.scores(picks)
+        value = self.evaluate(scores)
+        if start_temp is None:
+            start_temp = 1.0 if self.objective == 'expected' else 0.01
+        if end_temp is None:
+            end_temp = start_temp / 1000
+        cooling = (end_temp / start_temp) ** (1 / max(n_steps - 1, 1))
+
+        best_picks, best_value = picks.copy(), value
+        temp = start_temp
+        for _ in range(n_steps):
+            changes = self.flip(picks, self.rng.integers(self.pool.n_games))
+            if changes:
+                new_scores = scores + self.move_delta(changes)
+                new_value = self.evaluate(new_scores)
+                if new_value >= value or self.rng.random() < np.exp((new_value - value) / temp):
+                    self.apply(picks, changes)
+                    scores, value = new_scores, new_value
+                    if value > best_value:
+                        best_picks, best_value = picks.copy(), value
+            temp *= cooling
+        return best_picks, best_value
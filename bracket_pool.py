@@ -0,0 +1,124 @@
+## Office pool scoring - scores candidate brackets against simulated tournaments
+
+import numpy as np
+import pandas as pd
+from outcomes_store import load_outcomes, iter_outcome_chunks
+
+## Points for a correct pick in each round, first round to title game
+STANDARD_ROUND_POINTS = [10, 20, 40, 80, 160, 320]
+SCORE_CHUNK_SIZE = 65536
+
+class BracketPool:
+
+    def __init__(self, n_teams, round_offsets, game_lefts, game_rights, round_points = None) -> None:
+        ## Game layout as in a CompiledBracket / outcomes store - games numbered round by round, first round
+        ## lefts/rights are team rows and later ones are game numbers. A candidate bracket is one team row per game.
+        self.n_teams = n_teams
+        self.game_lefts = np.asarray(game_lefts)
+        self.game_rights = np.asarray(game_rights)
+        self.round_offsets = np.asarray(round_offsets)
+        self.n_rounds = len(self.round_offsets) - 1
+        self.n_games = int(self.round_offsets[-1])
+        self.game_round = np.repeat(np.arange(self.n_rounds), np.diff(self.round_offsets))
+
+        if round_points is None:
+            ## A play-in round scores nothing under standard rules
+            round_points = [0] * (self.n_rounds - len(STANDARD_ROUND_POINTS)) + STANDARD_ROUND_POINTS
+        if len(round_points) != self.n_rounds:
+            raise ValueError(f'Expected {self.n_rounds} round point values, got {len(round_points)}')
+        if any(int(points) != points or points < 0 for points in round_points):
+            raise ValueError('Round points must be non-negative integers')
+        self.round_points = np.array(round_points, dtype = np.int64)
+        self.max_score = int(self.round_points[self.game_round].sum())
+
+        ## feasible[k, t] - team t can appear in game k
+        self.feasible = np.zeros((self.n_games, n_teams), dtype = bool)
+        for k in range(self.n_games):
+            if k < self.round_offsets[1]:
+                self.feasible[k, [game_lefts[k], game_rights[k]]] = True
+            else:
+                self.feasible[k] = self.feasible[game_lefts[k]] | self.feasible[game_rights[k]]
+
+    @classmethod
+    def from_bracket(cls, bracket, round_points = None):
+        lefts, rights = bracket.flat_games()
+        return cls(bracket.n_teams, bracket.round_offsets(), lefts, rights, round_points)
+
+    @classmethod
+    def from_store(cls, path, round_points = None):
+        _, metadata = load_outcomes(path)
+        return cls(len(metadata['teams']), metadata['round_offsets'], metadata['game_lefts'], metadata['game_rights'], round_points)
+
+    def validate_picks(self, picks):
+        picks = np.atleast_2d(np.asarray(picks))
+        if picks.shape[1] != self.n_games:
+            raise ValueError(f'Each candidate needs {self.n_games} picks, got {picks.shape[1]}')
+        bad = ~self.feasible[np.arange(self.n_games), picks]
+        if bad.any():
+            candidate, game = np.argwhere(bad)[0]
+            raise ValueError(f'Candidate {candidate} picks team {picks[candidate, game]} in game {game}, which that team cannot reach')
+        return picks
+
+    def pick_matrix(self, picks):
+        ## (candidates x rounds * teams) - the points a candidate gets if team t wins a round r game
+        ## A team plays exactly one game per round, so this is the same as game-by-game scoring for feasible picks
+        picks = self.validate_picks(picks)
+        matrix = np.zeros((len(picks), self.n_rounds, self.n_teams), dtype = np.float32)
+        candidates = np.arange(len(picks))[:, None]
+        np.add.at(matrix, (candidates, self.game_round[None, :], picks), self.round_points[self.game_round])
+        return matrix.reshape(len(picks), -1)
+
+    def outcome_matrix(self, outcomes):
+        ## (sims x rounds * teams) - 1 where team t won a round r game in that simulation
+        outcomes = np.asarray(outcomes)
+        matrix = np.zeros((len(outcomes), self.n_rounds, self.n_teams), dtype = np.float32)
+        matrix[np.arange(len(outcomes))[:, None], self.game_round[None, :], outcomes] = 1
+        return matrix.reshape(len(outcomes), -1)
+
+    def score(self, picks, outcomes):
+        ## (candidates x sims) pool scores, as one matrix product
+        scores = self.pick_matrix(picks) @ self.outcome_matrix(outcomes).T
+        return np.rint(scores).astype(np.int32)
+
+    def score_histogram(self, picks, outcome_chunks):
+        ## (candidates x max_score + 1) count of simulations ending on each score - accumulated chunk by chunk,
+        ## so percentiles come out without holding every (candidate, sim) score at once
+        pick_matrix = self.pick_matrix(picks)
+        n_bins = self.max_score + 1
+        offsets = np.arange(len(pick_matrix))[:, None] * n_bins
+        histogram = np.zeros(len(pick_matrix) * n_bins, dtype = np.int64)
+        for outcomes in outcome_chunks:
+            scores = np.rint(pick_matrix @ self.outcome_matrix(outcomes).T).astype(np.int64)
+            histogram += np.bincount((scores + offsets).ravel(), minlength = len(histogram))
+        return histogram.reshape(len(pick_matrix), n_bins)
+
+    def summarize(self, picks, outcomes, percentiles = (5, 25, 50, 75, 95)):
+        ## outcomes is an array of simulated brackets or the path to an outcomes store
+        if isinstance(outcomes, str):
+            outcome_chunks = iter_outcome_chunks(outcomes, SCORE_CHUNK_SIZE)
+        else:
+            outcome_chunks = (outcomes[start:start + SCORE_CHUNK_SIZE] for start in range(0, len(outcomes), SCORE_CHUNK_SIZE))
+        histogram = self.score_histogram(picks, outcome_chunks)
+
+        score_values = np.arange(histogram.shape[1])
+        n_sims = histogram.sum(axis = 1)
+        expected = histogram @ score_values / n_sims
+        variance = histogram @ score_values ** 2 / n_sims - expected ** 2
+        summary = pd.DataFrame({'Candidate' : np.arange(len(histogram)), 'Expected score' : expected, 'Score SD' : np.sqrt(np.maximum(variance, 0))})
+
+        cdf = np.cumsum(histogram, axis = 1) / n_sims[:, None]
+        for percentile in percentiles:
+            summary[f'Score p{percentile}'] = np.argmax(cdf >= percentile / 100, axis = 1)
+        return summary
+
+def favorite_picks(bracket, ratings):
+    ## The chalk bracket - the higher rated team wins every game
+    lefts, rights = bracket.flat_games()
+    picks = np.empty(bracket.n_games, dtype = np.intp)
+    for k in range(bracket.n_games):
+        if k < bracket.round_offsets()[1]:
+            team1, team2 = lefts[k], rights[k]
+        else:
+            team1, team2 = picks[lefts[k]], picks[rights[k]]
+        picks[k] = team1 if ratings[team1] >= ratings[team2] else team2
+    return picks
@@ -0,0 +1,165 @@
+## Benchmarks every NCAA simulation engine in the repo against MM23_Sagarin.csv
+## Reports brackets/sec, wall time and peak memory, writes JSON and fails on throughput regressions vs a baseline
+## Also times a cold import of the engine, which should only need NumPy
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 10000, 100000]
+## The per-game pandas engines take minutes at large n, so they are only run up to this many brackets
+SLOW_ENGINE_MAX_SIMS = 1000
+
+## Modules the engine must not import at load time - they are only pulled in by the features that use them
+HEAVY_MODULES = ['pandas', 'scipy', 'numba', 'cProfile', 'pstats', 'multiprocessing']
+IMPORT_REPEATS = 5
+
+## Engines are loaded once per process so import time stays out of the measurements
+_modules = {}
+
+def load_module(name, path):
+    if name not in _modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[name] = module
+    return _modules[name]
+
+def class_engine(backend):
+    def run(sagarins, n, stdev, seed):
+        module = load_module('monte_carlo_py', 'monte_carlo_py.py')
+        return module.NCAA_simulation(sagarins, stdev, n, backend = backend, seed = seed).aggregate_simulations()
+    return run
+
+def no_class_engine(sagarins, n, stdev, seed):
+    module = load_module('monte_carlo_py_no_class', 'monte_carlo_py_no_class.py')
+    return module.aggregate_simulations(sagarins, n, stdev)
+
+def other_version_engine(version):
+    def run(sagarins, n, stdev, seed):
+        module = load_module(f'monte_carlo_py_{version}', f'Other Versions/monte_carlo_py_{version}.py')
+        if version == 'v4':
+            return module.NCAA_simulation(sagarins, stdev, n).aggregate_simulations()
+        return module.NCAA_simulation(sagarins, stdev = stdev, n_sims = n).run_simulations()
+    return run
+
+## name -> (runner, largest n worth running)
+ENGINES = {
+    'monte_carlo_py[numpy]' : (class_engine('numpy'), None),
+    'monte_carlo_py[numba]' : (class_engine('numba'), None),
+    'monte_carlo_py[pandas]' : (class_engine('pandas'), SLOW_ENGINE_MAX_SIMS),
+    'monte_carlo_py_no_class' : (no_class_engine, SLOW_ENGINE_MAX_SIMS),
+    'monte_carlo_py_v2' : (other_version_engine('v2'), SLOW_ENGINE_MAX_SIMS),
+    'monte_carlo_py_v3' : (other_version_engine('v3'), SLOW_ENGINE_MAX_SIMS),
+    'monte_carlo_py_v4' : (other_version_engine('v4'), SLOW_ENGINE_MAX_SIMS),
+}
+
+def benchmark_engine(runner, sagarins, n, stdev, seed):
+    ## Timed run first, then a second run under tracemalloc for peak memory so tracing doesn't skew the timing
+    start = time.perf_counter()
+    runner(sagarins.copy(), n, stdev, seed)
+    wall_time = time.perf_counter() - start
+
+    ## Working buffers kept between blocks would be warm from the timed run and missing from the peak
+    for module in _modules.values():
+        getattr(module, '_block_buffers', {}).clear()
+    tracemalloc.start()
+    runner(sagarins.copy(), n, stdev, seed)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'wall_time_s' : wall_time, 'brackets_per_s' : n / wall_time, 'peak_memory_mb' : peak_bytes / 2**20}
+
+def run_benchmarks(sagarins, engines, sizes, stdev = 10, seed = 0):
+    results = []
+    for name in engines:
+        runner, max_sims = ENGINES[name]
+        ## Warm up imports, caches and any JIT compilation before timing
+        try:
+            runner(sagarins.copy(), 1, stdev, seed)
+        except Exception:
+            pass
+        for n in sizes:
+            if max_sims is not None and n > max_sims:
+                continue
+            result = {'engine' : name, 'n' : n}
+            try:
+                result.update(benchmark_engine(runner, sagarins, n, stdev, seed))
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+            print(result)
+            results.append(result)
+    return results
+
+def measure_import_time(module = 'monte_carlo_py', repeats = IMPORT_REPEATS):
+    ## Best of several cold imports, each in a fresh interpreter, plus any heavy modules the import dragged in
+    script = (f'import sys, time; start = time.perf_counter(); import {module}; '
+              f'print(time.perf_counter() - start); print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', script], cwd = REPO_DIR, capture_output = True, text = True, check = True).stdout.split('\n')
+        times.append(float(output[0]))
+    heavy_modules = [name for name in output[1].split(',') if name]
+    result = {'engine' : f'import {module}', 'n' : 0, 'import_time_s' : min(times), 'heavy_modules' : heavy_modules}
+    print(result)
+    return result
+
+def find_regressions(results, baseline, threshold):
+    ## A regression is throughput more than threshold below the baseline for the same engine and n, or an engine that started failing
+    baseline_rates = {(r['engine'], r['n']) : r.get('brackets_per_s') for r in baseline}
+    baseline_imports = {r['engine'] : r['import_time_s'] for r in baseline if 'import_time_s' in r}
+    regressions = []
+    for result in results:
+        key = (result['engine'], result['n'])
+        if 'import_time_s' in result:
+            ## Import time regresses if it grows more than threshold or a heavy module is loaded eagerly again
+            base_time = baseline_imports.get(result['engine'])
+            if result['heavy_modules'] or (base_time is not None and result['import_time_s'] > base_time * (1 + threshold)):
+                regressions.append({'engine' : key[0], 'baseline' : base_time, 'current' : result['import_time_s'], 'heavy_modules' : result['heavy_modules']})
+            continue
+        base_rate = baseline_rates.get(key)
+        if base_rate is None:
+            continue
+        rate = result.get('brackets_per_s')
+        if rate is None or rate < base_rate * (1 - threshold):
+            regressions.append({'engine' : key[0], 'n' : key[1], 'baseline' : base_rate, 'current' : rate})
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the NCAA Monte Carlo engines')
+    parser.add_argument('--ratings', default = os.path.join(REPO_DIR, 'MM23_Sagarin.csv'))
+    parser.add_argument('--engines', nargs = '+', default = list(ENGINES), choices = list(ENGINES))
+    parser.add_argument('--sizes', nargs = '+', type = int, default = DEFAULT_SIZES)
+    parser.add_argument('--stdev', type = float, default = 10)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    parser.add_argument('--baseline', help = 'JSON results from a previous run to compare throughput against')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'Allowed fractional drop in brackets/sec (or growth in import time) before failing')
+    parser.add_argument('--skip-import-time', action = 'store_true', help = 'Skip the cold import benchmark')
+    args = parser.parse_args(argv)
+
+    sagarins = pd.read_csv(args.ratings)
+    results = [] if args.skip_import_time else [measure_import_time()]
+    results += run_benchmarks(sagarins, args.engines, args.sizes, args.stdev, args.seed)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,204 +1,831 @@
 ## Monte Carlo Simulations for Analytics (per PK request)
 
+## Only NumPy is needed to import the engine - pandas, scipy, numba and multiprocessing are imported
+## by the features that use them, so short-lived workers and CLI calls don't pay for them up front
+import math
 import numpy as np
-import pandas as pd
-import random
-import os
-from scipy.stats import norm
-import cProfile
-import pstats
-from multiprocessing import Process
+import warnings
+from collections import OrderedDict
+from bracket_compiler import CompiledBracket, load_bracket_config, compile_bracket
+from outcomes_store import create_outcomes_store, write_outcomes
+from profiling import Instrumentation
+
+BACKENDS = ['pandas', 'numpy', 'numba']
+MODES = ['sample', 'exact']
+## How uniforms are drawn across simulations - antithetic pairs (u, 1 - u), or a Latin hypercube per batch of
+## STRATIFIED_BATCH_SIZE simulations where every game slot gets exactly one draw in each 1 / batch size stratum
+SAMPLINGS = ['plain', 'antithetic', 'stratified']
+STRATIFIED_BATCH_SIZE = 128
+## Antithetic pairs drawn at a time, which bounds the temporaries when they are split into rounds
+ANTITHETIC_BATCH_SIZE = 4096
+## Default chance the target team is given of winning each of its games in importance sampling (see simulate_tilted)
+LONG_SHOT_TILT = 1.0
+## Simulations per seeded block - each block gets its own child seed, so results don't depend on how many workers split them
+SIM_BLOCK_SIZE = 65536
+## Rough working memory of one simulated game - draws, gathered teams, odds and winners - used to size blocks to a
+## memory budget (see NCAA_simulation.sims_per_block). Rating noise adds this much again per team.
+BLOCK_BYTES_PER_GAME = 24
+## Uniform draws pulled from the generator at a time by the pandas backend
+DRAW_BLOCK_SIZE = 4096
+
+## Win probability matrices keyed by (ratings, stdev), least recently used evicted first
+WIN_PROBS_CACHE_SIZE = 32
+_win_probs_cache = OrderedDict()
+_ndtr = None
+## Working buffers kept by each process between blocks, keyed by name (see block_buffer)
+_block_buffers = {}
+
+def normal_cdf(x):
+    ## Standard normal CDF - scipy's ndtr when scipy is installed, otherwise math.erf element by element
+    global _ndtr
+    if _ndtr is None:
+        try:
+            from scipy.special import ndtr
+            _ndtr = ndtr
+        except ImportError:
+            erf = np.vectorize(math.erf, otypes = [float])
+            _ndtr = lambda x: 0.5 * (1 + erf(np.asarray(x) / math.sqrt(2)))
+    return _ndtr(x)
+
+def win_probability_matrix(ratings, stdev):
+    ## probs[i, j] = chance team i beats team j, same as matchup_odds(ratings[i], ratings[j])
+    ratings = np.ascontiguousarray(ratings, dtype = float)
+    key = (hash(ratings.tobytes()), len(ratings), float(stdev))
+    if key in _win_probs_cache:
+        _win_probs_cache.move_to_end(key)
+        return _win_probs_cache[key]
+
+    probs = normal_cdf((ratings[:, None] - ratings[None, :]) / stdev)
+    probs.setflags(write = False)
+    _win_probs_cache[key] = probs
+    if len(_win_probs_cache) > WIN_PROBS_CACHE_SIZE:
+        _win_probs_cache.popitem(last = False)
+    return probs
+
+def block_buffer(name, size, dtype):
+    ## A flat array of size elements that is reused from block to block instead of allocated afresh - only grows
+    ## when a bigger block comes along. The contents are overwritten by the next block that asks for the same name.
+    buffer = _block_buffers.get(name)
+    if buffer is None or buffer.dtype != dtype or len(buffer) < size:
+        buffer = _block_buffers[name] = np.empty(size, dtype = dtype)
+    return buffer[:size]
+
+def stratified_uniforms(rng, num_sims, n_games):
+    ## Latin hypercube - within each batch every column is a random permutation of the strata plus uniform jitter
+    ## Yields (first simulation, batch x games draws) a batch at a time
+    for start in range(0, num_sims, STRATIFIED_BATCH_SIZE):
+        size = min(STRATIFIED_BATCH_SIZE, num_sims - start)
+        strata = rng.permuted(np.repeat(np.arange(size)[:, None], n_games, axis = 1), axis = 0)
+        yield start, (strata + rng.random((size, n_games))) / size
+
+def antithetic_uniforms(rng, num_sims, n_games):
+    ## Simulation s and s + half share their draws mirrored, and an odd one out keeps its own
+    ## Yields (first simulation, rows x games draws) ANTITHETIC_BATCH_SIZE rows of the first half at a time, each
+    ## followed by its mirror - the same draws as taking the whole first half in one call
+    half = -(-num_sims // 2)
+    for start in range(0, half, ANTITHETIC_BATCH_SIZE):
+        draws = rng.random((min(ANTITHETIC_BATCH_SIZE, half - start), n_games))
+        yield start, draws
+        yield half + start, 1 - draws[:num_sims - half - start]
+
+def sample_batches(num_sims, sampling):
+    ## Batch number of every simulation - batches are independent of each other, draws within one are not
+    if sampling == 'antithetic':
+        return np.arange(num_sims) % -(-num_sims // 2)
+    if sampling == 'stratified':
+        return np.arange(num_sims) // STRATIFIED_BATCH_SIZE
+    return np.arange(num_sims)
+
+def round_draws(rounds, num_sims, rng, locked = None, sampling = 'plain', out = None):
+    ## One (num_sims x games) block of uniforms per round, taken in round order
+    ## locked is None or (games, draws) from NCAA_simulation.locked_draws - a locked game's column is overwritten
+    ## with -1 (left team always wins) or 2 (right team always wins), after drawing so undecided games keep their draws
+    ## The rounds are consecutive views into out, a flat float buffer of num_sims * games (see block_buffer)
+    offsets = np.cumsum([0] + [len(left) for left, _ in rounds])
+    if out is None:
+        out = np.empty(num_sims * offsets[-1])
+    draws = [out[num_sims * offsets[r]:num_sims * offsets[r + 1]].reshape(num_sims, -1) for r in range(len(rounds))]
+    if sampling == 'plain':
+        for draw in draws:
+            rng.random(out = draw)
+    else:
+        ## Drawn a batch of simulations at a time with every game side by side, then split into the rounds - so the
+        ## only temporaries are one batch, whatever the block size
+        batches = antithetic_uniforms if sampling == 'antithetic' else stratified_uniforms
+        for start, batch in batches(rng, num_sims, offsets[-1]):
+            for r, draw in enumerate(draws):
+                draw[start:start + len(batch)] = batch[:, offsets[r]:offsets[r + 1]]
+    if locked is not None:
+        for game, draw in zip(*locked):
+            round_num = np.searchsorted(offsets, game, side = 'right') - 1
+            draws[round_num][:, game - offsets[round_num]] = draw
+    return draws
+
+def matrix_game_probs(win_probs):
+    return lambda team1, team2: win_probs[team1, team2]
+
+def noisy_game_probs(sim_ratings, stdev):
+    ## Each simulation has its own rating vector (sims x teams), so odds are looked up per row
+    rows = np.arange(len(sim_ratings))[:, None]
+    return lambda team1, team2: normal_cdf((sim_ratings[rows, team1] - sim_ratings[rows, team2]) / stdev)
+
+def simulate_brackets(rounds, game_probs, draws, round_counts = None, outcomes = None):
+    ## rounds comes from a CompiledBracket - the first round pairs team rows, later rounds pair positions in
+    ## the previous round's winners. game_probs(team1, team2) gives the chance team1 wins, draws holds one
+    ## uniform block per round (see round_draws). round_counts (rounds x teams) is optionally incremented
+    ## with how often each team won in each round, and outcomes (sims x games) optionally filled with the
+    ## winner of every game, numbered round by round.
+    teams = None
+    game = 0
+    for round_num, ((left, right), round_draw) in enumerate(zip(rounds, draws)):
+        if teams is None:
+            team1 = np.broadcast_to(left, round_draw.shape)
+            team2 = np.broadcast_to(right, round_draw.shape)
+        else:
+            team1 = teams[:, left]
+            team2 = teams[:, right]
+        teams = np.where(round_draw < game_probs(team1, team2), team1, team2)
+        if round_counts is not None:
+            round_counts[round_num] += np.bincount(teams.ravel(), minlength = round_counts.shape[1])
+        if outcomes is not None:
+            outcomes[:, game:game + len(left)] = teams
+        game += len(left)
+
+    return teams[:, 0]
+
+def block_draws(bracket, num_sims, rng, locked, sampling):
+    return round_draws(bracket.rounds, num_sims, rng, locked, sampling, block_buffer('draws', num_sims * bracket.n_games, float))
+
+def block_outcomes(bracket, num_sims, outcomes_store):
+    if outcomes_store is None:
+        return None
+    return block_buffer('outcomes', num_sims * bracket.n_games, np.uint8).reshape(num_sims, bracket.n_games)
+
+def batch_moments(champions, n_teams, sampling):
+    ## Per team sums over independent batches b of c_b^2, c_b m_b and m_b^2 plus the number of batches, where c_b is
+    ## the team's titles in the batch and m_b its size - enough for the variance of Win% (see win_standard_errors)
+    num_sims = len(champions)
+    if sampling == 'plain':
+        ## Every simulation is its own batch, so c_b is 0 or 1 and m_b is 1
+        titles = np.bincount(champions, minlength = n_teams).astype(float)
+        return np.array([titles, titles, np.full(n_teams, num_sims), np.full(n_teams, num_sims)], dtype = float)
+    batches = sample_batches(num_sims, sampling)
+    sizes = np.bincount(batches)
+    ## Only the (batch, team) pairs that won a title, so memory stays O(num_sims) rather than batches x teams
+    keys, counts = np.unique(batches * n_teams + champions, return_counts = True)
+    teams = keys % n_teams
+    return np.array([
+        np.bincount(teams, weights = counts.astype(float) ** 2, minlength = n_teams),
+        np.bincount(teams, weights = counts * sizes[keys // n_teams].astype(float), minlength = n_teams),
+        np.full(n_teams, (sizes.astype(float) ** 2).sum()),
+        np.full(n_teams, len(sizes)),
+    ])
+
+def win_standard_errors(title_counts, moments, num_sims):
+    ## Standard error of Win% from the spread of independent batches, and the effective sample size - the number of
+    ## plain simulations with the same standard error, p (1 - p) / Var(p)
+    p = title_counts / num_sims
+    sum_c2, sum_cm, sum_m2, n_batches = moments
+    spread = np.maximum(sum_c2 - 2 * p * sum_cm + p ** 2 * sum_m2, 0)
+    variance = n_batches / np.maximum(n_batches - 1, 1) * spread / num_sims ** 2
+    plain_variance = p * (1 - p)
+    ess = np.divide(plain_variance, variance, out = np.full(len(p), np.nan), where = variance > 0)
+    return np.sqrt(variance) * 100, ess
+
+def run_block(block):
+    ## (simulate_block, args) -> simulate_block(*args), for Pool.imap
+    simulate_block, args = block
+    return simulate_block(*args)
+
+def simulate_round_counts(bracket, win_probs, num_sims, rng, outcomes_store = None, locked = None, sampling = 'plain'):
+    ## One seeded block of simulations - module level so it can be shipped to a worker process
+    ## outcomes_store is None or (path, first row) for writing every bracket to an outcomes_store file
+    ## locked is None or the known results from NCAA_simulation.locked_draws, sampling one of SAMPLINGS
+    ## Returns (round_counts, batch_moments of the champions)
+    round_counts = np.zeros((len(bracket.rounds), len(win_probs)), dtype = np.int64)
+    outcomes = block_outcomes(bracket, num_sims, outcomes_store)
+    draws = block_draws(bracket, num_sims, rng, locked, sampling)
+    champions = simulate_brackets(bracket.rounds, matrix_game_probs(win_probs), draws, round_counts, outcomes)
+    if outcomes_store is not None:
+        write_outcomes(outcomes_store, outcomes)
+    return round_counts, batch_moments(champions, len(win_probs), sampling)
+
+def simulate_round_counts_noisy(bracket, ratings, stdev, rating_stdev, num_sims, rng, outcomes_store = None, locked = None, sampling = 'plain'):
+    ## Parameter uncertainty - every simulation plays on its own ratings + N(0, rating_stdev), all drawn in one batch
+    ## sampling only shapes the game uniforms, the rating noise is always drawn plainly
+    round_counts = np.zeros((len(bracket.rounds), len(ratings)), dtype = np.int64)
+    outcomes = block_outcomes(bracket, num_sims, outcomes_store)
+    draws = block_draws(bracket, num_sims, rng, locked, sampling)
+    sim_ratings = ratings + rating_stdev * rng.standard_normal((num_sims, len(ratings)))
+    champions = simulate_brackets(bracket.rounds, noisy_game_probs(sim_ratings, stdev), draws, round_counts, outcomes)
+    if outcomes_store is not None:
+        write_outcomes(outcomes_store, outcomes)
+    return round_counts, batch_moments(champions, len(ratings), sampling)
+
+def simulate_tilted(bracket, win_probs, target, tilt, num_sims, rng, locked = None):
+    ## Importance sampling for one target team - every game it plays is drawn as if it won with chance
+    ## max(p, tilt) instead of p, and each bracket carries the likelihood ratio of the true odds to the tilted
+    ## ones for the target's games (locked games are left alone). Any other game is drawn as usual, so its ratio is 1.
+    ## Returns (2 x rounds) sums over the block of w * I and (w * I)^2, where I is whether the target won the round
+    ## and w the ratio of its games up to and including that round - the mean of w * I is an unbiased estimate.
+    draws = block_draws(bracket, num_sims, rng, locked, 'plain')
+    offsets = bracket.round_offsets()
+    untilted = np.ones(bracket.n_games, dtype = bool)
+    if locked is not None:
+        untilted[locked[0]] = False
+    weights = np.ones(num_sims)
+    sums = np.zeros((2, len(bracket.rounds)))
+    teams = None
+    for round_num, ((left, right), round_draw) in enumerate(zip(bracket.rounds, draws)):
+        if teams is None:
+            team1 = np.broadcast_to(left, round_draw.shape)
+            team2 = np.broadcast_to(right, round_draw.shape)
+        else:
+            team1 = teams[:, left]
+            team2 = teams[:, right]
+        probs = win_probs[team1, team2]
+        tilted = untilted[offsets[round_num]:offsets[round_num + 1]]
+        ## A bye is the target playing itself - it advances whatever the draw, so there is nothing to tilt
+        left_target = (team1 == target) & (team2 != target) & tilted
+        right_target = (team2 == target) & (team1 != target) & tilted
+        tilted_probs = np.where(left_target, np.maximum(probs, tilt), np.where(right_target, np.minimum(probs, 1 - tilt), probs))
+        left_wins = round_draw < tilted_probs
+        teams = np.where(left_wins, team1, team2)
+        ## Untilted games have tilted_probs == probs, so their ratio is 1 whichever side won
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ratios = np.where(left_wins, probs / tilted_probs, (1 - probs) / (1 - tilted_probs))
+        weights *= np.where(left_target | right_target, ratios, 1).prod(axis = 1)
+        hits = np.where((teams == target).any(axis = 1), weights, 0)
+        sums[0, round_num] = hits.sum()
+        sums[1, round_num] = (hits ** 2).sum()
+    return sums
+
+def simulate_round_counts_numba(bracket, win_probs, num_sims, rng, outcomes_store = None, locked = None, sampling = 'plain'):
+    ## Same draws as the numpy engine side by side, so a seed gives the same brackets on both backends
+    from numba_kernel import bracket_kernel
+    offsets = bracket.round_offsets()
+    lefts, rights = bracket.flat_games()
+    draws = block_buffer('draws', num_sims * bracket.n_games, float)
+    round_draws(bracket.rounds, num_sims, rng, locked, sampling, draws)
+    outcomes = block_buffer('kernel outcomes', num_sims * bracket.n_games, np.intp).reshape(num_sims, bracket.n_games)
+    bracket_kernel(lefts, rights, offsets, win_probs, draws, outcomes)
+
+    round_counts = np.zeros((len(bracket.rounds), len(win_probs)), dtype = np.int64)
+    for r in range(len(bracket.rounds)):
+        round_counts[r] = np.bincount(outcomes[:, offsets[r]:offsets[r + 1]].ravel(), minlength = len(win_probs))
+    if outcomes_store is not None:
+        write_outcomes(outcomes_store, outcomes.astype(np.uint8))
+    return round_counts, batch_moments(outcomes[:, -1], len(win_probs), sampling)
 
 class NCAA_simulation:
 
-    def __init__(self, sagarins, stdev, n) -> None:
+    def __init__(self, sagarins, stdev, n, backend = 'numpy', mode = 'sample', seed = None, workers = 1, rating_stdev = 0, bracket = None, outcomes_path = None, locked_results = None, sampling = 'plain', memory_budget = None) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend!r}, expected one of {BACKENDS}')
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode {mode!r}, expected one of {MODES}')
+        if sampling not in SAMPLINGS:
+            raise ValueError(f'Unknown sampling {sampling!r}, expected one of {SAMPLINGS}')
+        ## numba is optional - without it the numba backend falls back to numpy
+        if backend == 'numba':
+            try:
+                import numba_kernel
+            except ImportError:
+                warnings.warn('numba is not installed, falling back to the numpy backend')
+                backend = 'numpy'
+        if workers > 1 and backend == 'pandas':
+            raise ValueError('workers > 1 is not supported by the pandas backend')
+        if rating_stdev and (backend == 'pandas' or mode == 'exact'):
+            raise ValueError('rating_stdev needs the numpy or numba backend in sample mode')
+        if outcomes_path and (backend == 'pandas' or mode == 'exact'):
+            raise ValueError('outcomes_path needs the numpy or numba backend in sample mode')
+        if sampling != 'plain' and (backend == 'pandas' or mode == 'exact'):
+            raise ValueError(f'{sampling} sampling needs the numpy or numba backend in sample mode')
+        if memory_budget is not None and memory_budget <= 0:
+            raise ValueError(f'memory_budget must be positive, got {memory_budget}')
         self.sagarins = sagarins
         self.stdev = stdev
         self.num_sims = n
-        self.winners = []
+        self.backend = backend
+        self.rating_stdev = rating_stdev
+        ## The numba kernel reads a fixed odds matrix, so rating uncertainty always runs through numpy
+        if rating_stdev:
+            self.simulate_block = simulate_round_counts_noisy
+        elif backend == 'numba':
+            self.simulate_block = simulate_round_counts_numba
+        else:
+            self.simulate_block = simulate_round_counts
+        self.mode = mode
+        self.sampling = sampling
+        ## Batch moments of the champions from the last sampled run, for Win% standard errors (see batch_moments)
+        self.moments = None
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.draws = np.empty(0)
+        self.draw_pos = 0
+        self.workers = workers
+        ## Bytes of working memory per process (the main one, or each worker) - bounds the block size, so memory
+        ## stays flat in n
+        self.memory_budget = memory_budget
+        ## Pandas backend tally of how often each team won in each round (rounds x teams), set up by aggregate_simulations
+        self.pandas_round_counts = None
         self.round_64_matchups = None
+        ## bracket is a config path / dict compiled against sagarins, or an already compiled bracket (see load_ratings)
+        if isinstance(bracket, CompiledBracket):
+            self.bracket_config = None
+            self.bracket = bracket
+        else:
+            self.bracket_config = load_bracket_config(bracket)
+            self.bracket = None
+        ## Optional .npy file that receives every simulated bracket (see outcomes_store)
+        self.outcomes_path = outcomes_path
+        self.team_index = None
+        self.win_probs = None
+        ## Per-phase timers and counters, accumulated over every run of this object (see profiling)
+        self.instrumentation = Instrumentation()
+        ## Live mode - winning team row of every decided game, numbered as in CompiledBracket.flat_games
+        self.locked = {}
+        ## Exact mode caches every game's winner distribution and only recomputes stale games (see exact_round_probs)
+        self.game_dists = None
+        self.game_dists_probs = None
+        self.stale_games = set()
+        for winner, loser in locked_results or []:
+            self.lock_result(winner, loser)
 
     def matchup_odds(self, sag1, sag2):
-        prob = norm.cdf(0, loc = sag2 - sag1, scale = self.stdev)
+        prob = normal_cdf((sag1 - sag2) / self.stdev)
         return prob
 
-    def sim_game(self, sag1, sag2):
-        prob = self.matchup_odds(sag1, sag2)
-        rand = random.random()
+    def generate_win_probs(self, teams_df):
+        ## Pairwise odds for the whole field, looked up by row position instead of calling the normal CDF per game
+        self.team_index = {team : i for i, team in enumerate(teams_df['Team'])}
+        self.win_probs = win_probability_matrix(teams_df['Sagarin rating'].to_numpy(dtype = float), self.stdev)
+
+    def next_draw(self):
+        ## Hand out uniforms from a pre-generated block instead of one generator call per game
+        if self.draw_pos == len(self.draws):
+            self.draws = self.rng.random(DRAW_BLOCK_SIZE)
+            self.draw_pos = 0
+        rand = self.draws[self.draw_pos]
+        self.draw_pos += 1
+        return rand
+
+    def sim_game(self, team1, team2):
+        prob = self.win_probs[self.team_index[team1], self.team_index[team2]]
+        rand = self.next_draw()
         return rand < prob
 
     def sim_round(self, matchups_df):
+        import pandas as pd
         winners = []
         for i, row in matchups_df.iterrows():
-            sag1 = row['Sagarin rating1']
-            sag2 = row['Sagarin rating2']
-            outcome = self.sim_game(sag1, sag2)
-            if outcome:
-                team = row['Team1']
-                seed = row['Seed1']
-                sag = sag1
-            else:
-                team = row['Team2']
-                seed = row['Seed2']
-                sag = sag2
-
-            if 'Region' in matchups_df.columns:
-                region = row['Region']
-                winner_dict = {'Region' : region, 'Seed' : seed, 'Team' : team, 'Sagarin rating' : sag}
-
-            else:
-                winner_dict = {'Seed' : seed, 'Team' : team, 'Sagarin rating' : sag}
-
+            outcome = self.sim_game(row['Team1'], row['Team2'])
+            side = '1' if outcome else '2'
+            winner_dict = {'Region' : row['Region' + side], 'Seed' : row['Seed' + side], 'Team' : row['Team' + side], 'Sagarin rating' : row['Sagarin rating' + side]}
             winners.append(winner_dict)
 
         winner_df = pd.DataFrame(winners)
         return winner_df
 
-    def generate_round_64_matchups(self, teams_df):
-        n_matchups = len(teams_df) // 8
-        matchups = []
-        regions = list(set(teams_df['Region']))
-        for region in regions:
-            tdf = teams_df[teams_df['Region'] == region]
-            for i in range(n_matchups):
-                seed1 = int(i + 1)
-                seed2 = int(17 - seed1)
-
-                team1 = tdf.loc[tdf['Seed'] == seed1, 'Team'].iat[0]
-                sag1 = tdf.loc[tdf['Seed'] == seed1, 'Sagarin rating'].iat[0]
-                team2 = tdf.loc[tdf['Seed'] == seed2, 'Team'].iat[0]
-                sag2 = tdf.loc[tdf['Seed'] == seed2, 'Sagarin rating'].iat[0]
-                matchup_dict = {'Region' : region, 'Seed1' : seed1, 'Team1' : team1, 'Sagarin rating1' : sag1, 'Seed2' : seed2, 'Team2' : team2, 'Sagarin rating2' : sag2}
-                matchups.append(matchup_dict)
-
-        matchup_df = pd.DataFrame(matchups)
-        self.round_64_matchups = matchup_df
-
-    def generate_midround_matchups(self, teams_df):
-        regions = list(set(teams_df['Region']))
-        matchups = []
-
-        ## Pick the correct matchup sets based on the round (how many teams remaining)
-        set1 = [1,8,9,16]
-        set2 = [2,7,10,15]
-        set3 = [3,6,11,14]
-        set4 = [4,5,12,13]
-
-        if len(teams_df) == 32:
-            sets = [set1, set2, set3, set4]
-        elif len(teams_df) == 16:
-            set1 = set1 + set4
-            set2 = set2 + set3
-            sets = [set1, set2]
-        elif len(teams_df) == 8:
-            sets = [set1 + set2 + set3 + set4]
-
-        for seed_set in sets:
-            tdf = teams_df[teams_df['Seed'].isin(seed_set)]
-            for region in regions:
-                tdf1 = tdf.loc[tdf['Region'] == region]
-
-                team1 = tdf1['Team'].iat[0]
-                sag1 = tdf1['Sagarin rating'].iat[0]
-                seed1 = tdf1['Seed'].iat[0]
-                team2 = tdf1['Team'].iat[1]
-                sag2 = tdf1['Sagarin rating'].iat[1]
-                seed2 = tdf1['Seed'].iat[1]
-                matchup_dict = {'Region' : region, 'Seed1' : seed1, 'Team1' : team1, 'Sagarin rating1' : sag1, 'Seed2' : seed2, 'Team2' : team2, 'Sagarin rating2' : sag2}
-                matchups.append(matchup_dict)
-                            
-        matchup_df = pd.DataFrame(matchups)
+    def generate_matchups(self, teams_df, left, right):
+        ## Pair row left[g] of teams_df with row right[g] for every game g
+        import pandas as pd
+        team1 = teams_df.iloc[left].reset_index(drop = True)
+        team2 = teams_df.iloc[right].reset_index(drop = True)
+        columns = ['Region', 'Seed', 'Team', 'Sagarin rating']
+        matchup_df = pd.concat([team1[columns].add_suffix('1'), team2[columns].add_suffix('2')], axis = 1)
         return matchup_df
 
-    def generate_round_4_matchups(self, teams_df):
-        ## This one uses actual hard coded region names and matchups - not sure  if this is always consitant across years
-        regions_match1 = ['East', 'South']
-        regions_match2 = ['Midwest', 'West']
-        regions_matchups = [regions_match1, regions_match2]
-        matchups = []
-
-        for region_set in regions_matchups:
-            tdf1 = teams_df[teams_df['Region'].isin(region_set)]
-
-            team1 = tdf1['Team'].iat[0]
-            sag1 = tdf1['Sagarin rating'].iat[0]
-            seed1 = tdf1['Seed'].iat[0]
-            team2 = tdf1['Team'].iat[1]
-            sag2 = tdf1['Sagarin rating'].iat[1]
-            seed2 = tdf1['Seed'].iat[1]
-            matchup_dict = {'Seed1' : seed1, 'Team1' : team1, 'Sagarin rating1' : sag1, 'Seed2' : seed2, 'Team2' : team2, 'Sagarin rating2' : sag2}
-            matchups.append(matchup_dict)
-
-        matchup_df = pd.DataFrame(matchups)
-        return matchup_df
+    def generate_round_64_matchups(self, teams_df):
+        left, right = self.bracket.rounds[0]
+        self.round_64_matchups = self.generate_matchups(teams_df, left, right)
 
-    def generate_round_2_matchup(self, teams_df):
-        team1 = teams_df['Team'].iat[0]
-        sag1 = teams_df['Sagarin rating'].iat[0]
-        seed1 = teams_df['Seed'].iat[0]
-        team2 = teams_df['Team'].iat[1]
-        sag2 = teams_df['Sagarin rating'].iat[1]
-        seed2 = teams_df['Seed'].iat[1]
-        matchup_dict = {'Seed1' : seed1, 'Team1' : team1, 'Sagarin rating1' : sag1, 'Seed2' : seed2, 'Team2' : team2, 'Sagarin rating2' : sag2}
+    def simulate_bracket(self):
+        ## Each later round pairs positions in the previous round's winners, as laid out by the compiled bracket
+        round_teams = self.sim_round(self.round_64_matchups)
+        self.tally_round(0, round_teams)
+        for round_num, (left, right) in enumerate(self.bracket.rounds[1:], 1):
+            matchups_df = self.generate_matchups(round_teams, left, right)
+            round_teams = self.sim_round(matchups_df)
+            self.tally_round(round_num, round_teams)
+
+    def tally_round(self, round_num, round_teams):
+        ## A team wins at most one game per round, so plain fancy indexing counts each winner once
+        rows = [self.team_index[team] for team in round_teams['Team']]
+        self.pandas_round_counts[round_num, rows] += 1
+
+    def generate_bracket(self, teams_df):
+        ## Compiled once per simulation, so locked games keep their numbers across runs
+        if self.bracket is None:
+            self.bracket = compile_bracket(self.bracket_config, teams_df)
+
+    def team_games(self, team):
+        ## Every game team would play on the way to the title, in order
+        lefts, rights = self.bracket.flat_games()
+        n_first_round = self.bracket.round_offsets()[1]
+        game = np.flatnonzero((lefts[:n_first_round] == team) | (rights[:n_first_round] == team))[0]
+        games = [game]
+        while game != self.bracket.n_games - 1:
+            game = np.flatnonzero((lefts[n_first_round:] == game) | (rights[n_first_round:] == game))[0] + n_first_round
+            games.append(game)
+        return games
+
+    def lock_result(self, winner, loser):
+        ## Record a finished game by team names. The game is the first one both teams' paths share, and reaching it
+        ## means each team won every earlier game on its path, so those are locked too.
+        if self.backend == 'pandas':
+            raise ValueError('Locked results need the numpy or numba backend')
+        self.generate_bracket(self.sagarins)
+        team_rows = {team : i for i, team in enumerate(self.sagarins['Team'])}
+        for team in (winner, loser):
+            if team not in team_rows:
+                raise ValueError(f'Unknown team {team!r}')
+        if winner == loser:
+            raise ValueError(f'{winner!r} cannot play itself')
+
+        winner_games = self.team_games(team_rows[winner])
+        loser_games = self.team_games(team_rows[loser])
+        game = next(game for game in winner_games if game in loser_games)
+        results = [(g, team_rows[winner]) for g in winner_games if g <= game]
+        results += [(g, team_rows[loser]) for g in loser_games if g < game]
+
+        names = self.sagarins['Team'].tolist()
+        for g, team in results:
+            if self.locked.get(g, team) != team:
+                raise ValueError(f'{winner} beating {loser} conflicts with {names[self.locked[g]]} winning game {g}')
+        for g, team in results:
+            if g not in self.locked:
+                self.locked[g] = team
+                self.mark_stale(g)
+        return game
+
+    def mark_stale(self, game):
+        ## A game's cached distribution is stale, and so is every game its winner feeds into
+        lefts, rights = self.bracket.flat_games()
+        n_first_round = self.bracket.round_offsets()[1]
+        while True:
+            self.stale_games.add(game)
+            parents = np.flatnonzero((lefts[n_first_round:] == game) | (rights[n_first_round:] == game))
+            if len(parents) == 0:
+                break
+            game = parents[0] + n_first_round
+
+    def locked_draws(self):
+        ## (games, draws) forcing every locked game in round_draws, or None when nothing is locked
+        ## The winner's side is fixed by the bracket even when its opponent isn't known (e.g. a later game locked
+        ## before the opponent's earlier game) - that opponent's own earlier games are still simulated as usual
+        if not self.locked:
+            return None
+        lefts, _ = self.bracket.flat_games()
+        n_first_round = self.bracket.round_offsets()[1]
+        games = np.array(sorted(self.locked))
+        from_left = []
+        for game in games:
+            winner = self.locked[game]
+            from_left.append(lefts[game] == winner if game < n_first_round else lefts[game] in self.team_games(winner))
+        return games, np.where(from_left, -1.0, 2.0)
+
+    def simulate_brackets_vectorized(self, num_sims, rng):
+        draws = round_draws(self.bracket.rounds, num_sims, rng, self.locked_draws(), self.sampling)
+        return simulate_brackets(self.bracket.rounds, matrix_game_probs(self.win_probs), draws)
+
+    def block_args(self, num_sims, rng, outcomes_store = None):
+        ## Arguments for self.simulate_block
+        if self.rating_stdev:
+            ratings = self.sagarins['Sagarin rating'].to_numpy(dtype = float)
+            return (self.bracket, ratings, self.stdev, self.rating_stdev, num_sims, rng, outcomes_store, self.locked_draws(), self.sampling)
+        return (self.bracket, self.win_probs, num_sims, rng, outcomes_store, self.locked_draws(), self.sampling)
+
+    def sims_per_block(self):
+        ## SIM_BLOCK_SIZE, or fewer if a block would go over memory_budget. The budget is per process, so block sizes
+        ## (the seeding unit) never depend on workers - a budget tight enough to shrink them does change seeded results
+        if self.memory_budget is None:
+            return SIM_BLOCK_SIZE
+        sim_bytes = BLOCK_BYTES_PER_GAME * self.bracket.n_games
+        if self.rating_stdev:
+            sim_bytes += BLOCK_BYTES_PER_GAME * len(self.sagarins)
+        block_sims = int(self.memory_budget // sim_bytes)
+        if block_sims < 1:
+            raise ValueError(f'memory_budget of {self.memory_budget} bytes is too small for one simulation')
+        return min(SIM_BLOCK_SIZE, block_sims)
+
+    def block_rngs(self):
+        ## (first simulation, simulations, generator) per block - children of the run's generator are spawned as the
+        ## blocks are reached, giving the same streams as spawning them all up front without holding them all at once
+        block_size = self.sims_per_block()
+        for start in range(0, self.num_sims, block_size):
+            yield start, min(block_size, self.num_sims - start), self.rng.spawn(1)[0]
+
+    def simulation_blocks(self):
+        ## Split num_sims into fixed size blocks, each with an independent child of the run's generator
+        ## Yields (simulate_block, args) lazily, so 100M simulations never means 1,500 blocks in memory
+        ## The blocks are only generated once sampling starts, so any outcomes store must already exist
+        for start, block_sims, block_rng in self.block_rngs():
+            outcomes_store = (self.outcomes_path, start) if self.outcomes_path else None
+            yield self.simulate_block, self.block_args(block_sims, block_rng, outcomes_store)
+
+    def count_games(self, num_sims, n_blocks = 1):
+        self.instrumentation.count('blocks', n_blocks)
+        self.instrumentation.count('brackets', num_sims)
+        self.instrumentation.count('games', num_sims * self.bracket.n_games)
+
+    def round_counts(self):
+        ## Outcomes store writes happen inside the blocks, so with outcomes_path set they are timed as sampling
+        ## Block results are added up as they arrive rather than collected, so memory doesn't grow with n_blocks
+        if self.outcomes_path:
+            with self.instrumentation.phase('io'):
+                create_outcomes_store(self.outcomes_path, self.num_sims, self.bracket, self.sagarins)
+        blocks = self.simulation_blocks()
+        n_blocks = -(-self.num_sims // self.sims_per_block())
+        round_counts = np.zeros((len(self.bracket.rounds), len(self.sagarins)), dtype = np.int64)
+        self.moments = 0
+        with self.instrumentation.phase('sampling'):
+            if self.workers > 1 and n_blocks > 1:
+                ## Spawned, not forked - a fork after numba's threading layer has started leaves the parent hanging at exit
+                import multiprocessing
+                with multiprocessing.get_context('spawn').Pool(min(self.workers, n_blocks)) as pool:
+                    for block_counts, block_moments in pool.imap(run_block, blocks):
+                        round_counts += block_counts
+                        self.moments = self.moments + block_moments
+            else:
+                for block in blocks:
+                    block_counts, block_moments = run_block(block)
+                    round_counts += block_counts
+                    self.moments = self.moments + block_moments
+        self.count_games(self.num_sims, n_blocks)
+        return round_counts
+
+    def add_round_columns(self, teams_df, round_counts, num_sims):
+        for column, counts in zip(self.bracket.round_names, round_counts):
+            teams_df[column] = counts * 100 / num_sims
+        teams_df['Win%'] = round_counts[-1] * 100 / num_sims
+
+    def aggregate_simulations_vectorized(self):
+        sagarins = self.sagarins
+        with self.instrumentation.phase('setup'):
+            self.generate_bracket(sagarins)
+        with self.instrumentation.phase('probabilities'):
+            self.generate_win_probs(sagarins)
+
+        round_counts = self.round_counts()
+        with self.instrumentation.phase('aggregation'):
+            self.add_round_columns(sagarins, round_counts, self.num_sims)
+            ## With variance reduction the binomial error no longer applies, so report the measured one instead
+            if self.sampling != 'plain':
+                sagarins['Win% SE'], sagarins['Win% ESS'] = win_standard_errors(round_counts[-1], self.moments, self.num_sims)
 
-        matchup_df = pd.DataFrame([matchup_dict])
-        return matchup_df
+        return sagarins
 
-    def simulate_bracket(self):
-        round_32_teams = self.sim_round(self.round_64_matchups)
-        matchups_df = self.generate_midround_matchups(round_32_teams)
-        round_16_teams = self.sim_round(matchups_df)
-        matchups_df = self.generate_midround_matchups(round_16_teams)
-        round_8_teams = self.sim_round(matchups_df)
-        matchups_df = self.generate_midround_matchups(round_8_teams)
-        round_4_teams = self.sim_round(matchups_df)
-        matchups_df = self.generate_round_4_matchups(round_4_teams)
-        round_2_teams = self.sim_round(matchups_df)
-        matchups_df = self.generate_round_2_matchup(round_2_teams)
-        winner = self.sim_round(matchups_df)
-        self.winners.append(winner['Team'][0])
+    def iter_simulations(self, chunk_size = 10000, tolerance = 0.1):
+        ## Run brackets chunk by chunk, yielding (sims so far, results with 'Win% SE') after each one
+        ## Stops once every team's standard error on Win% is under tolerance (percentage points), or at num_sims -
+        ## binomial for plain sampling, measured across independent batches otherwise (with 'Win% ESS' alongside)
+        if self.backend == 'pandas' or self.mode == 'exact':
+            raise ValueError('iter_simulations needs the numpy or numba backend in sample mode')
+        if self.outcomes_path:
+            raise ValueError('iter_simulations does not write an outcomes_path store, use aggregate_simulations')
+        sagarins = self.sagarins
+        with self.instrumentation.phase('setup'):
+            self.generate_bracket(sagarins)
+        with self.instrumentation.phase('probabilities'):
+            self.generate_win_probs(sagarins)
+
+        round_counts = np.zeros((len(self.bracket.rounds), len(sagarins)), dtype = np.int64)
+        self.moments = 0
+        sims_done = 0
+        chunk_size = min(chunk_size, self.sims_per_block())
+        while sims_done < self.num_sims:
+            chunk_sims = min(chunk_size, self.num_sims - sims_done)
+            chunk_rng = self.rng.spawn(1)[0]
+            with self.instrumentation.phase('sampling'):
+                chunk_counts, chunk_moments = self.simulate_block(*self.block_args(chunk_sims, chunk_rng))
+            round_counts += chunk_counts
+            self.moments = self.moments + chunk_moments
+            self.count_games(chunk_sims)
+            sims_done += chunk_sims
+
+            with self.instrumentation.phase('aggregation'):
+                results = sagarins.copy()
+                self.add_round_columns(results, round_counts, sims_done)
+                if self.sampling == 'plain':
+                    win_rate = round_counts[-1] / sims_done
+                    results['Win% SE'] = np.sqrt(win_rate * (1 - win_rate) / sims_done) * 100
+                else:
+                    results['Win% SE'], results['Win% ESS'] = win_standard_errors(round_counts[-1], self.moments, sims_done)
+            yield sims_done, results
+
+            if results['Win% SE'].max() < tolerance:
+                break
+
+    def sweep(self, stdevs, rating_noises = None):
+        ## Run every (stdev, rating noise) grid point on the same uniform and normal draws (common random numbers),
+        ## so differences between points reflect the parameters rather than sampling noise. Rating noise adds
+        ## N(0, rating_noise) to every team's rating, drawn separately for each simulation, and defaults to the
+        ## object's rating_stdev. Every point still plays its own brackets, so a sweep costs about one run per point
+        ## on the numpy backend - use backend = 'numba', which plays all fixed odds points in one kernel pass over
+        ## the draws, or exact mode, which solves each point exactly. Returns one long table with a row per grid
+        ## point and team.
+        if self.backend == 'pandas':
+            raise ValueError('sweep needs the numpy or numba backend')
+        if self.outcomes_path:
+            raise ValueError('sweep does not write an outcomes_path store, use aggregate_simulations')
+        if rating_noises is None:
+            rating_noises = (self.rating_stdev,)
+        if self.mode == 'exact' and any(rating_noises):
+            raise ValueError('Rating noise needs sample mode')
+        sagarins = self.sagarins
+        with self.instrumentation.phase('setup'):
+            self.generate_bracket(sagarins)
+        ratings = sagarins['Sagarin rating'].to_numpy(dtype = float)
+        rounds = self.bracket.rounds
+        grid = [(stdev, rating_noise) for stdev in stdevs for rating_noise in rating_noises]
+
+        if self.mode == 'exact':
+            win_probs = self.win_probs
+            with self.instrumentation.phase('probabilities'):
+                grid_probs = []
+                for stdev, _ in grid:
+                    self.win_probs = win_probability_matrix(ratings, stdev)
+                    grid_probs.append(self.exact_round_probs())
+            self.win_probs = win_probs
+            ## Exact odds scaled to counts, so the table comes out the same as a sampled one
+            return self.sweep_results(grid, np.array(grid_probs) * self.num_sims)
+
+        locked = self.locked_draws()
+        grid_counts = np.zeros((len(grid), len(rounds), len(sagarins)), dtype = np.int64)
+        fixed_points = [point for point, (_, rating_noise) in enumerate(grid) if not rating_noise]
+        point_probs = np.array([win_probability_matrix(ratings, grid[point][0]) for point in fixed_points])
+        n_blocks = -(-self.num_sims // self.sims_per_block())
+        with self.instrumentation.phase('sampling'):
+            for _, block_sims, block_rng in self.block_rngs():
+                draws = block_draws(self.bracket, block_sims, block_rng, locked, self.sampling)
+                if any(rating_noises):
+                    rating_draws = block_rng.standard_normal((block_sims, len(sagarins)))
+
+                if self.backend == 'numba' and fixed_points:
+                    grid_counts[fixed_points] += self.sweep_block_numba(point_probs, block_sims)
+                for point, (stdev, rating_noise) in enumerate(grid):
+                    if rating_noise:
+                        game_probs = noisy_game_probs(ratings + rating_noise * rating_draws, stdev)
+                    elif self.backend == 'numba':
+                        continue
+                    else:
+                        game_probs = matrix_game_probs(point_probs[fixed_points.index(point)])
+                    simulate_brackets(rounds, game_probs, draws, grid_counts[point])
+        self.count_games(self.num_sims * len(grid), n_blocks * len(grid))
+        return self.sweep_results(grid, grid_counts)
+
+    def sweep_block_numba(self, point_probs, num_sims):
+        ## Round counts (points x rounds x teams) for one block, read from the draws block_draws just filled
+        from numba import get_num_threads
+        from numba_kernel import sweep_kernel
+        lefts, rights = self.bracket.flat_games()
+        draws = block_buffer('draws', num_sims * self.bracket.n_games, float)
+        ## A few chunks per thread so uneven chunks still keep every thread busy
+        n_chunks = min(num_sims, 4 * get_num_threads())
+        counts = np.zeros((n_chunks, len(point_probs), len(self.bracket.rounds), len(self.sagarins)), dtype = np.int64)
+        sweep_kernel(lefts, rights, self.bracket.round_offsets(), point_probs, draws, counts)
+        return counts.sum(axis = 0)
+
+    def sweep_results(self, grid, grid_counts):
+        import pandas as pd
+        with self.instrumentation.phase('aggregation'):
+            point_results = []
+            for (stdev, rating_noise), round_counts in zip(grid, grid_counts):
+                results = self.sagarins.copy()
+                results.insert(0, 'Rating noise', rating_noise)
+                results.insert(0, 'Stdev', stdev)
+                self.add_round_columns(results, round_counts, self.num_sims)
+                point_results.append(results)
+
+            return pd.concat(point_results, ignore_index = True)
+
+    def importance_sample(self, teams, tilt = LONG_SHOT_TILT, confidence = 0.95):
+        ## Round by round odds for long shots whose title chances plain sampling would report as 0, e.g. 16 seeds
+        ## around 1e-6. Each team gets its own num_sims brackets, tilted toward it winning every game and reweighted
+        ## by likelihood ratio (see simulate_tilted), so the estimates stay unbiased. tilt is the chance the team is
+        ## given in each game it is an underdog in - 1 always sends it through and leaves only its opponents random.
+        ## Returns a row per team with the usual round columns, plus 'Win% SE', a normal confidence interval and
+        ## 'Win% ESS', the number of plain simulations with the same standard error.
+        from statistics import NormalDist
+        if self.backend == 'pandas' or self.mode == 'exact':
+            raise ValueError('Importance sampling needs the numpy or numba backend in sample mode')
+        if self.rating_stdev or self.sampling != 'plain' or self.outcomes_path:
+            raise ValueError('Importance sampling draws its own plain brackets - rating_stdev, sampling and outcomes_path are not supported')
+        if not 0 < tilt <= 1:
+            raise ValueError(f'tilt must be in (0, 1], got {tilt}')
+        if not 0 < confidence < 1:
+            raise ValueError(f'confidence must be in (0, 1), got {confidence}')
+        sagarins = self.sagarins
+        with self.instrumentation.phase('setup'):
+            self.generate_bracket(sagarins)
+        with self.instrumentation.phase('probabilities'):
+            self.generate_win_probs(sagarins)
+        team_rows = {team : i for i, team in enumerate(sagarins['Team'])}
+        for team in teams:
+            if team not in team_rows:
+                raise ValueError(f'Unknown team {team!r}')
+        locked = self.locked_draws()
+
+        n_blocks = -(-self.num_sims // self.sims_per_block())
+        team_sums = np.zeros((len(teams), 2, len(self.bracket.rounds)))
+        with self.instrumentation.phase('sampling'):
+            for _, block_sims, block_rng in self.block_rngs():
+                ## Every team is tilted on the same uniforms
+                block_state = block_rng.bit_generator.state
+                for t, team in enumerate(teams):
+                    block_rng.bit_generator.state = block_state
+                    team_sums[t] += simulate_tilted(self.bracket, self.win_probs, team_rows[team], tilt, block_sims, block_rng, locked)
+        self.count_games(self.num_sims * len(teams), n_blocks * len(teams))
+
+        with self.instrumentation.phase('aggregation'):
+            results = sagarins.iloc[[team_rows[team] for team in teams]].reset_index(drop = True)
+            estimates = team_sums[:, 0] / self.num_sims
+            for column, probs in zip(self.bracket.round_names, estimates.T):
+                results[column] = probs * 100
+            win = estimates[:, -1]
+            variance = np.maximum(team_sums[:, 1, -1] / self.num_sims - win ** 2, 0) / max(self.num_sims - 1, 1)
+            z = NormalDist().inv_cdf((1 + confidence) / 2)
+            results['Win%'] = win * 100
+            results['Win% SE'] = np.sqrt(variance) * 100
+            results['Win% CI low'] = np.maximum(win - z * np.sqrt(variance), 0) * 100
+            results['Win% CI high'] = np.minimum(win + z * np.sqrt(variance), 1) * 100
+            results['Win% ESS'] = np.divide(win * (1 - win), variance, out = np.full(len(win), np.nan), where = variance > 0)
+
+        return results
+
+    def exact_round_probs(self):
+        ## Dynamic programming over the bracket tree - games are independent, so the chance team i wins a game is
+        ## P(i arrives on one side) * sum over j of P(j arrives on the other side) * P(i beats j)
+        ## Each game's winner distribution is cached, and a locked game's is the winner with certainty. After
+        ## lock_result only the stale games - the newly locked ones and everything downstream - are recomputed.
+        probs = self.win_probs
+        lefts, rights = self.bracket.flat_games()
+        offsets = self.bracket.round_offsets()
+        if self.game_dists is None or self.game_dists_probs is not probs:
+            self.game_dists = np.zeros((self.bracket.n_games, len(probs)))
+            self.game_dists_probs = probs
+            self.stale_games = set(range(self.bracket.n_games))
+
+        teams = np.eye(len(probs))
+        dists = self.game_dists
+        ## Game numbers run round by round, so feeder games are always refreshed before the games they feed
+        for game in sorted(self.stale_games):
+            if game in self.locked:
+                dists[game] = teams[self.locked[game]]
+                continue
+            if game < offsets[1]:
+                left_dist = teams[lefts[game]]
+                right_dist = teams[rights[game]]
+            else:
+                left_dist = dists[lefts[game]]
+                right_dist = dists[rights[game]]
+            dists[game] = left_dist * (probs @ right_dist) + right_dist * (probs @ left_dist)
+        self.stale_games = set()
+
+        return np.add.reduceat(dists, offsets[:-1], axis = 0)
+
+    def aggregate_simulations_exact(self):
+        sagarins = self.sagarins
+        with self.instrumentation.phase('setup'):
+            self.generate_bracket(sagarins)
+        with self.instrumentation.phase('probabilities'):
+            self.generate_win_probs(sagarins)
+            round_probs = self.exact_round_probs()
+
+        with self.instrumentation.phase('aggregation'):
+            for column, probs in zip(self.bracket.round_names, round_probs):
+                sagarins[column] = probs * 100
+            sagarins['Win%'] = round_probs[-1] * 100
+
+        return sagarins
 
     def aggregate_simulations(self):
+        if self.mode == 'exact':
+            return self.aggregate_simulations_exact()
+        if self.backend != 'pandas':
+            return self.aggregate_simulations_vectorized()
+
         sagarins = self.sagarins
-        self.generate_round_64_matchups(sagarins)
+        with self.instrumentation.phase('setup'):
+            self.generate_bracket(sagarins)
+            self.generate_round_64_matchups(sagarins)
+        with self.instrumentation.phase('probabilities'):
+            self.generate_win_probs(sagarins)
 
-        for _ in range(self.num_sims):
-            self.simulate_bracket()
+        self.pandas_round_counts = np.zeros((len(self.bracket.rounds), len(sagarins)), dtype = np.int64)
+        with self.instrumentation.phase('sampling'):
+            for _ in range(self.num_sims):
+                self.simulate_bracket()
+        self.count_games(self.num_sims)
 
-        sagarins['Win%'] = 0
-        for winner in self.winners:
-            sagarins.loc[sagarins['Team'] == winner, 'Win%'] += 100/n
+        with self.instrumentation.phase('aggregation'):
+            self.add_round_columns(sagarins, self.pandas_round_counts, self.num_sims)
 
         return sagarins
 
 if __name__ == '__main__':
-    ## Set file directory as current directory
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-    ## Load in sagarin ratings table
-    sagarins = pd.read_csv('MM23_Sagarin.csv')
-    n = 1000
-    stdev = 10
-    sim = NCAA_simulation(sagarins, stdev, n)
-    simulation_results = sim.aggregate_simulations()
-    simulation_results.to_csv(f'NCAA_2023_n{n}_stdev{stdev}_results_1.csv', index =  False)
-
-    '''
-    # Create a cProfile object and run the function
-    profiler = cProfile.Profile()
-    profiler.enable()
-    simulation_results = aggregate_simulations(sagarins, n, stdev)
-    profiler.disable()
-    cProfile.run('aggregate_simulations(sagarins, n, stdev)')
-
-    # Set profile results file name
-    output_file = "profiling_results.txt"
-
-    # Write the profiling results to a text file
-    with open(output_file, 'w') as file:
-        stats = pstats.Stats(profiler, stream=file)
-        stats.sort_stats('cumulative')
-        stats.print_stats()
-    '''
-
-
+    ## Command line options and batch manifests live in ncaa_cli
+    import sys
+    from ncaa_cli import main
+    sys.exit(main())
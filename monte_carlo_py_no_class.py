@@ -5,8 +5,6 @@ import pandas as pd
 import random
 import os
 from scipy.stats import norm
-import cProfile
-import pstats
 
 def matchup_odds(sag1, sag2, stdev):
     prob = norm.cdf(0, loc = sag2 - sag1, scale = stdev)
@@ -151,44 +149,37 @@ def simulate_bracket(matchups_df, stdev = 10):
 
 def aggregate_simulations(sagarins, n = 1000, stdev = 10):
     winners = []
+    team_index = {team : i for i, team in enumerate(sagarins['Team'])}
     round_64_matchups = generate_round_64_matchups(sagarins)
     for _ in range(n):
         outcome = simulate_bracket(round_64_matchups, stdev)
-        winners.append(outcome['Team'][0])
+        winners.append(team_index[outcome['Team'][0]])
 
-    sagarins['Win%'] = 0
-    for winner in winners:
-        sagarins.loc[sagarins['Team'] == winner, 'Win%'] += 100/n
+    ## Winners are row positions, so one bincount tallies every simulation
+    win_counts = np.bincount(winners, minlength = len(sagarins))
+    sagarins['Win%'] = win_counts * 100 / n
 
     return sagarins
 
 if __name__ == '__main__':
-    ## Set file directory as current directory
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import argparse
+    from profiling import profile_run
+
+    parser = argparse.ArgumentParser(description = 'NCAA tournament Monte Carlo simulation')
+    parser.add_argument('--ratings', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MM23_Sagarin.csv'))
+    parser.add_argument('-n', '--sims', type = int, default = 10000)
+    parser.add_argument('--stdev', type = float, default = 10)
+    parser.add_argument('--output', default = 'NCAA_n{sims}_stdev{stdev}_results.csv')
+    parser.add_argument('--profile', nargs = '?', const = 'profile', metavar = 'PREFIX',
+                        help = 'Profile the run, writing PREFIX.pstats and PREFIX.collapsed (flamegraph input)')
+    args = parser.parse_args()
 
     ## Load in sagarin ratings table
-    sagarins = pd.read_csv('MM23_Sagarin.csv')
-    n = 10000
-    stdev = 10
-    simulation_results = aggregate_simulations(sagarins, n, stdev)
-    simulation_results.to_csv(f'NCAA_2023_n{n}_stdev{stdev}_results_1.csv', index =  False)
-
-    '''
-    # Create a cProfile object and run the function
-    profiler = cProfile.Profile()
-    profiler.enable()
-    simulation_results = aggregate_simulations(sagarins, n, stdev)
-    profiler.disable()
-    cProfile.run('aggregate_simulations(sagarins, n, stdev)')
-
-    # Set profile results file name
-    output_file = "profiling_results.txt"
-
-    # Write the profiling results to a text file
-    with open(output_file, 'w') as file:
-        stats = pstats.Stats(profiler, stream=file)
-        stats.sort_stats('cumulative')
-        stats.print_stats()
-    '''
-
-
+    sagarins = pd.read_csv(args.ratings)
+    n = args.sims
+    stdev = args.stdev
+    if args.profile:
+        simulation_results = profile_run(lambda: aggregate_simulations(sagarins, n, stdev), args.profile)
+    else:
+        simulation_results = aggregate_simulations(sagarins, n, stdev)
+    simulation_results.to_csv(args.output.format(sims = n, stdev = stdev), index =  False)
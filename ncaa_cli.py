@@ -0,0 +1,186 @@
+## Command line entry point for NCAA_simulation - one run from flags, or a batch of jobs from a JSON/YAML manifest
+## All jobs run in one process, so ratings files, compiled brackets and odds matrices are loaded once and reused
+##
+## A manifest is either a list of jobs or {'defaults' : {...}, 'jobs' : [...]}. A job sets any of JOB_FIELDS, and a
+## list value expands into one job per entry, so {'ratings' : ['MM22.csv', 'MM23.csv'], 'stdev' : [8, 10, 12]} is six
+## jobs. Relative paths are read from the manifest's directory. output and outcomes are templates filled from the
+## job's fields plus {name}, the ratings file name without its extension. results lists finished games as
+## [winner, loser] pairs and long_shots lists teams to importance sample (see NCAA_simulation.importance_sample),
+## and these are the list fields that are not expanded. A job with long_shots writes a row per long shot team.
+
+import argparse
+import itertools
+import json
+import os
+import sys
+from monte_carlo_py import BACKENDS, MODES, SAMPLINGS, NCAA_simulation
+from ratings_loader import load_ratings
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+JOB_DEFAULTS = {
+    'ratings' : os.path.join(REPO_DIR, 'MM23_Sagarin.csv'),
+    'sims' : 1000,
+    'stdev' : 10,
+    'seed' : None,
+    'workers' : 1,
+    'memory_budget' : None,
+    'engine' : 'numpy',
+    'mode' : 'sample',
+    'sampling' : 'plain',
+    'rating_stdev' : 0,
+    'bracket' : None,
+    'outcomes' : None,
+    'results' : None,
+    'long_shots' : None,
+    'output' : 'NCAA_{name}_n{sims}_stdev{stdev:g}_results.csv',
+}
+JOB_FIELDS = list(JOB_DEFAULTS)
+LIST_FIELDS = ['results', 'long_shots']
+PATH_FIELDS = ['ratings', 'bracket', 'outcomes', 'output']
+
+def load_manifest(path):
+    with open(path) as file:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f'Reading {path} needs PyYAML, or write the manifest as JSON')
+            manifest = yaml.safe_load(file)
+        else:
+            manifest = json.load(file)
+    if isinstance(manifest, list):
+        manifest = {'jobs' : manifest}
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('jobs'), list):
+        raise ValueError(f'{path} needs a list of jobs, or a mapping with a jobs list')
+    return manifest
+
+def expand_jobs(manifest, base_dir = '.'):
+    ## One dict of every JOB_FIELD per job, list values expanded into their cartesian product
+    jobs = []
+    for entry in manifest['jobs']:
+        ## Only paths written in the manifest are relative to it - built in defaults are left alone
+        given = {**manifest.get('defaults', {}), **entry}
+        unknown = set(given) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown job fields {sorted(unknown)}, expected some of {JOB_FIELDS}')
+        job = {**JOB_DEFAULTS, **given}
+        grid = {field : value for field, value in job.items() if isinstance(value, list) and field not in LIST_FIELDS}
+        for values in itertools.product(*grid.values()):
+            expanded = {**job, **dict(zip(grid, values))}
+            for field in PATH_FIELDS:
+                if field in given and expanded[field] is not None:
+                    expanded[field] = os.path.join(base_dir, expanded[field])
+            jobs.append(expanded)
+    return jobs
+
+def is_number(value, integer = False):
+    ## Manifest values are whatever JSON/YAML gave - bools and strings are not numbers here
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return not integer or float(value).is_integer()
+
+def validate_job(job):
+    if job['engine'] not in BACKENDS:
+        raise ValueError(f'Unknown engine {job["engine"]!r}, expected one of {BACKENDS}')
+    if job['mode'] not in MODES:
+        raise ValueError(f'Unknown mode {job["mode"]!r}, expected one of {MODES}')
+    if job['sampling'] not in SAMPLINGS:
+        raise ValueError(f'Unknown sampling {job["sampling"]!r}, expected one of {SAMPLINGS}')
+    if not is_number(job['sims'], integer = True) or job['sims'] < 1:
+        raise ValueError(f'sims must be a positive integer, got {job["sims"]!r}')
+    if not is_number(job['workers'], integer = True) or job['workers'] < 1:
+        raise ValueError(f'workers must be a positive integer, got {job["workers"]!r}')
+    if job['seed'] is not None and (not is_number(job['seed'], integer = True) or job['seed'] < 0):
+        raise ValueError(f'seed must be a non-negative integer, got {job["seed"]!r}')
+    ## Written as not (x > 0) so NaN is rejected too
+    if not is_number(job['stdev']) or not job['stdev'] > 0:
+        raise ValueError(f'stdev must be a positive number, got {job["stdev"]!r}')
+    if not is_number(job['rating_stdev']) or not job['rating_stdev'] >= 0:
+        raise ValueError(f'rating_stdev must be a non-negative number, got {job["rating_stdev"]!r}')
+    if job['memory_budget'] is not None and (not is_number(job['memory_budget']) or not job['memory_budget'] > 0):
+        raise ValueError(f'memory_budget must be a positive number of MB, got {job["memory_budget"]!r}')
+
+def job_path(job, field):
+    if job[field] is None:
+        return None
+    name = os.path.splitext(os.path.basename(job['ratings']))[0]
+    return job[field].format(name = name, **job)
+
+def run_jobs(jobs, verbose = False):
+    ## Every job is validated before the first one runs, so a typo late in a manifest fails fast
+    for job in jobs:
+        validate_job(job)
+    for field in ['output', 'outcomes']:
+        paths = [job_path(job, field) for job in jobs if job[field] is not None]
+        if len(set(paths)) < len(paths):
+            raise ValueError(f'Jobs share {field} paths - add fields like {{stdev}} or {{seed}} to the {field} template')
+
+    loaded = {}
+    outputs = []
+    for job in jobs:
+        key = (os.path.abspath(job['ratings']), job['bracket'])
+        if key not in loaded:
+            loaded[key] = load_ratings(job['ratings'], job['bracket'])
+        sagarins, bracket = loaded[key]
+
+        ## The simulation adds result columns to its table, so each job gets its own copy
+        sim = NCAA_simulation(sagarins.copy(), job['stdev'], int(job['sims']), backend = job['engine'], mode = job['mode'],
+                              seed = job['seed'] and int(job['seed']), workers = int(job['workers']), rating_stdev = job['rating_stdev'],
+                              bracket = bracket, outcomes_path = job_path(job, 'outcomes'), locked_results = job['results'],
+                              sampling = job['sampling'], memory_budget = job['memory_budget'] and job['memory_budget'] * 2**20)
+        if job['long_shots']:
+            results = sim.importance_sample(job['long_shots'])
+        else:
+            results = sim.aggregate_simulations()
+        path = job_path(job, 'output')
+        with sim.instrumentation.phase('io'):
+            results.to_csv(path, index = False)
+        outputs.append(path)
+
+        print(f'{path}: {job["sims"]} sims, stdev {job["stdev"]}, {sum(sim.instrumentation.timings.values()):.2f}s')
+        if verbose:
+            print(sim.instrumentation.report())
+    return outputs
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'NCAA tournament Monte Carlo simulation')
+    parser.add_argument('--manifest', help = 'JSON or YAML file listing jobs to run, instead of the single job given by the flags')
+    parser.add_argument('--ratings', default = JOB_DEFAULTS['ratings'], help = 'Ratings CSV with Region, Seed, Team and Sagarin rating columns')
+    parser.add_argument('-n', '--sims', type = int, default = JOB_DEFAULTS['sims'])
+    parser.add_argument('--stdev', type = float, default = JOB_DEFAULTS['stdev'])
+    parser.add_argument('--seed', type = int, default = JOB_DEFAULTS['seed'])
+    parser.add_argument('--workers', type = int, default = JOB_DEFAULTS['workers'])
+    parser.add_argument('--memory-budget', type = float, metavar = 'MB',
+                        help = 'Working memory for simulation blocks in each process - smaller blocks keep big runs within it')
+    parser.add_argument('--engine', choices = BACKENDS, default = JOB_DEFAULTS['engine'])
+    parser.add_argument('--mode', choices = MODES, default = JOB_DEFAULTS['mode'])
+    parser.add_argument('--sampling', choices = SAMPLINGS, default = JOB_DEFAULTS['sampling'],
+                        help = 'Antithetic or stratified draws report Win% SE and ESS (effective sample size) columns')
+    parser.add_argument('--rating-stdev', type = float, default = JOB_DEFAULTS['rating_stdev'])
+    parser.add_argument('--bracket', help = 'Bracket config JSON, the NCAA bracket by default')
+    parser.add_argument('--outcomes', help = '.npy file to store every simulated bracket in, a template like --output')
+    parser.add_argument('--result', nargs = 2, action = 'append', dest = 'results', metavar = ('WINNER', 'LOSER'),
+                        help = 'A finished game, repeat for each one - the remaining games are simulated around it')
+    parser.add_argument('--long-shot', action = 'append', dest = 'long_shots', metavar = 'TEAM',
+                        help = 'Importance sample TEAM\'s odds instead of running the whole field, repeat for each team')
+    parser.add_argument('--output', default = JOB_DEFAULTS['output'], help = 'Results CSV, a template filled from the job fields and the ratings file {name}')
+    parser.add_argument('--profile', nargs = '?', const = 'profile', metavar = 'PREFIX',
+                        help = 'Profile the run, writing PREFIX.pstats and PREFIX.collapsed (flamegraph input)')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.manifest:
+            jobs = expand_jobs(load_manifest(args.manifest), os.path.dirname(os.path.abspath(args.manifest)))
+        else:
+            jobs = [{field : getattr(args, field) for field in JOB_FIELDS}]
+        if args.profile:
+            from profiling import profile_run
+            profile_run(lambda: run_jobs(jobs, verbose = True), args.profile)
+        else:
+            run_jobs(jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+## numba compiled bracket kernel - its own module so numba is only imported when the numba backend runs
+
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel = True, cache = True)
+def bracket_kernel(lefts, rights, offsets, win_probs, draws, outcomes):
+    ## outcomes[s, k] is the winner of game k of simulation s, with games numbered round by round
+    ## (CompiledBracket.flat_games) - first round games read team rows, later games read earlier outcomes
+    ## draws is round_draws' flat buffer - round r is a (sims x games in r) block starting at sims * offsets[r]
+    num_sims = outcomes.shape[0]
+    for s in prange(num_sims):
+        for r in range(offsets.shape[0] - 1):
+            n_round_games = offsets[r + 1] - offsets[r]
+            row = num_sims * offsets[r] + s * n_round_games - offsets[r]
+            for k in range(offsets[r], offsets[r + 1]):
+                if r == 0:
+                    team1 = lefts[k]
+                    team2 = rights[k]
+                else:
+                    team1 = outcomes[s, lefts[k]]
+                    team2 = outcomes[s, rights[k]]
+                outcomes[s, k] = team1 if draws[row + k] < win_probs[team1, team2] else team2
+
+@njit(parallel = True, cache = True)
+def sweep_kernel(lefts, rights, offsets, point_probs, draws, counts):
+    ## Plays every simulation once per odds matrix in point_probs (points x teams x teams) on the same draws, laid out
+    ## as in bracket_kernel. counts[c, p, r, t] tallies round r wins for team t at point p within chunk c of the
+    ## simulations - chunks run in parallel on their own tallies and the caller sums them
+    n_chunks = counts.shape[0]
+    n_games = lefts.shape[0]
+    num_sims = draws.shape[0] // n_games
+    for c in prange(n_chunks):
+        outcomes = np.empty(n_games, dtype = np.intp)
+        for s in range(c * num_sims // n_chunks, (c + 1) * num_sims // n_chunks):
+            for p in range(point_probs.shape[0]):
+                for r in range(offsets.shape[0] - 1):
+                    n_round_games = offsets[r + 1] - offsets[r]
+                    row = num_sims * offsets[r] + s * n_round_games - offsets[r]
+                    for k in range(offsets[r], offsets[r + 1]):
+                        if r == 0:
+                            team1 = lefts[k]
+                            team2 = rights[k]
+                        else:
+                            team1 = outcomes[lefts[k]]
+                            team2 = outcomes[rights[k]]
+                        winner = team1 if draws[row + k] < point_probs[p, team1, team2] else team2
+                        outcomes[k] = winner
+                        counts[c, p, r, winner] += 1
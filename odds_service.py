@@ -0,0 +1,210 @@
+## Local HTTP/JSON odds service - wraps NCAA_simulation behind an asyncio server, stdlib only
+##
+##   POST /odds  {"ratings" : "MM23_Sagarin.csv", "stdev" : 10, "n" : 100000, "seed" : 1, "mode" : "sample",
+##                "engine" : "numpy", "results" : [["FDU", "Purdue"]]}
+##   GET  /odds?ratings=MM23_Sagarin.csv&stdev=10&n=100000&seed=1&result=FDU,Purdue
+##   GET  /stats
+##
+## Simulations run in a process pool so the event loop keeps serving. Finished tables are kept in an LRU cache keyed by
+## (ratings file hash, stdev, n, seed, locked results, mode, engine), and identical requests that arrive while one is
+## being computed wait on that computation instead of starting their own.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from bracket_compiler import load_bracket_config
+from monte_carlo_py import BACKENDS, MODES, NCAA_simulation
+from ratings_loader import file_key, load_ratings
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+ODDS_CACHE_SIZE = 128
+## Largest n a request may ask for, so one request can't tie up a worker for hours - the per-game pandas engine
+## manages a few dozen brackets a second, so it gets a cap of minutes rather than the vectorized engines' seconds
+MAX_SIMS = 10_000_000
+PANDAS_MAX_SIMS = 10_000
+MAX_BODY_BYTES = 1_000_000
+STATUS_TEXT = {200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found', 405 : 'Method Not Allowed', 500 : 'Internal Server Error'}
+
+## Ratings tables already loaded by this worker process, keyed by ratings file hash
+_worker_ratings = {}
+
+def compute_odds(path, ratings_key, stdev, n, seed, mode, engine, results):
+    ## Runs in a worker process - returns the results table as JSON-ready records
+    if ratings_key not in _worker_ratings:
+        _worker_ratings[ratings_key] = load_ratings(path)
+    sagarins, bracket = _worker_ratings[ratings_key]
+    sim = NCAA_simulation(sagarins.copy(), stdev, n, backend = engine, mode = mode, seed = seed,
+                          bracket = bracket, locked_results = results)
+    return sim.aggregate_simulations().to_dict('records')
+
+class OddsService:
+
+    def __init__(self, ratings_dir = REPO_DIR, workers = None, cache_size = ODDS_CACHE_SIZE) -> None:
+        self.ratings_dir = os.path.abspath(ratings_dir)
+        ## Workers are spawned, not forked - a forked worker would inherit open client sockets and hold them open
+        self.executor = ProcessPoolExecutor(workers, mp_context = multiprocessing.get_context('spawn'))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        ## Ratings file hashes keyed by (path, modification time, size), so unchanged files aren't rehashed per request
+        self.file_keys = {}
+        self.stats = {'requests' : 0, 'hits' : 0, 'misses' : 0, 'coalesced' : 0, 'errors' : 0}
+
+    def ratings_path(self, name):
+        ## Requests name a file inside ratings_dir - anything resolving outside it is refused
+        path = os.path.abspath(os.path.join(self.ratings_dir, name))
+        if os.path.dirname(path) != self.ratings_dir or not os.path.isfile(path):
+            raise ValueError(f'Unknown ratings file {name!r}')
+        return path
+
+    def ratings_key(self, path):
+        info = os.stat(path)
+        stat_key = (path, info.st_mtime_ns, info.st_size)
+        if stat_key not in self.file_keys:
+            self.file_keys[stat_key] = file_key(path, load_bracket_config())
+        return self.file_keys[stat_key]
+
+    def parse_job(self, params):
+        unknown = set(params) - {'ratings', 'stdev', 'n', 'seed', 'mode', 'engine', 'results'}
+        if unknown:
+            raise ValueError(f'Unknown parameters {sorted(unknown)}')
+        path = self.ratings_path(params.get('ratings', 'MM23_Sagarin.csv'))
+        try:
+            stdev = float(params.get('stdev', 10))
+            n = int(params.get('n', 10000))
+            seed = None if params.get('seed') is None else int(params['seed'])
+        except (TypeError, ValueError):
+            raise ValueError('stdev, n and seed must be numbers')
+        if not 0 < stdev < float('inf'):
+            raise ValueError(f'stdev must be positive, got {stdev}')
+        mode = params.get('mode', 'sample')
+        engine = params.get('engine', 'numpy')
+        if mode not in MODES or engine not in BACKENDS:
+            raise ValueError(f'mode must be one of {MODES} and engine one of {BACKENDS}')
+        max_sims = PANDAS_MAX_SIMS if engine == 'pandas' and mode == 'sample' else MAX_SIMS
+        if not 0 < n <= max_sims:
+            raise ValueError(f'n must be between 1 and {max_sims} for the {engine} engine, got {n}')
+        results = params.get('results') or []
+        if not all(isinstance(result, (list, tuple)) and len(result) == 2 for result in results):
+            raise ValueError('results must be a list of [winner, loser] pairs')
+        ## Locked results are a set - the order they were reported in doesn't change the odds
+        results = tuple(sorted((str(winner), str(loser)) for winner, loser in results))
+        return path, self.ratings_key(path), stdev, n, seed, mode, engine, results
+
+    async def compute(self, key, job):
+        try:
+            records = await asyncio.get_running_loop().run_in_executor(self.executor, compute_odds, *job)
+        finally:
+            del self.pending[key]
+        self.cache[key] = records
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+        return records
+
+    async def odds(self, params):
+        job = self.parse_job(params)
+        key = job[1:]
+        if key in self.cache:
+            self.stats['hits'] += 1
+            self.cache.move_to_end(key)
+            records, cached = self.cache[key], True
+        else:
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            else:
+                self.stats['misses'] += 1
+                self.pending[key] = asyncio.ensure_future(self.compute(key, job))
+            ## shield - a client hanging up must not cancel a computation other requests are waiting on
+            records, cached = await asyncio.shield(self.pending[key]), False
+        _, ratings_key, stdev, n, seed, mode, engine, results = job
+        return {'ratings' : os.path.basename(job[0]), 'ratings_hash' : ratings_key, 'stdev' : stdev, 'n' : n, 'seed' : seed,
+                'mode' : mode, 'engine' : engine, 'results' : [list(result) for result in results], 'cached' : cached, 'teams' : records}
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/stats' and method == 'GET':
+            return 200, {**self.stats, 'cached_tables' : len(self.cache), 'in_flight' : len(self.pending)}
+        if url.path != '/odds':
+            return 404, {'error' : f'No route {url.path}'}
+        if method == 'GET':
+            query = parse_qs(url.query)
+            params = {name : values[-1] for name, values in query.items() if name != 'result'}
+            if 'result' in query:
+                params['results'] = [result.split(',', 1) for result in query['result']]
+        elif method == 'POST':
+            try:
+                params = json.loads(body or b'{}')
+            except ValueError:
+                return 400, {'error' : 'Body is not valid JSON'}
+            if not isinstance(params, dict):
+                return 400, {'error' : 'Body must be a JSON object'}
+        else:
+            return 405, {'error' : f'{method} not allowed'}
+        return 200, await self.odds(params)
+
+    async def handle(self, reader, writer):
+        ## One request per connection - HTTP/1.1 request line, headers, then a Content-Length body
+        self.stats['requests'] += 1
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) != 3:
+                status, payload = 400, {'error' : 'Malformed request line'}
+            elif int(headers.get('content-length', 0)) > MAX_BODY_BYTES:
+                status, payload = 400, {'error' : 'Request body too large'}
+            else:
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self.route(request_line[0], request_line[1], body)
+        except ValueError as e:
+            status, payload = 400, {'error' : str(e)}
+        except Exception as e:
+            status, payload = 500, {'error' : f'{type(e).__name__}: {e}'}
+        if status != 200:
+            self.stats['errors'] += 1
+
+        data = json.dumps(payload).encode()
+        writer.write(f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host = '127.0.0.1', port = 8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f'Serving odds on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Local HTTP/JSON service for NCAA tournament odds')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--workers', type = int, help = 'Simulation processes, one per CPU by default')
+    parser.add_argument('--ratings-dir', default = REPO_DIR, help = 'Directory requests may read ratings files from')
+    parser.add_argument('--cache-size', type = int, default = ODDS_CACHE_SIZE, help = 'Results tables kept in the LRU cache')
+    args = parser.parse_args(argv)
+
+    service = OddsService(args.ratings_dir, args.workers, args.cache_size)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.executor.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+## On-disk store of every simulated bracket - one uint8 row of game winners per simulation in a .npy file,
+## plus a .json sidecar describing the teams and game layout. Blocks write straight into the memory-mapped
+## file, and readers open it with mmap_mode = 'r' so millions of brackets never have to sit in RAM at once.
+
+import json
+import numpy as np
+
+def metadata_path(path):
+    return path + '.json'
+
+def create_outcomes_store(path, num_sims, bracket, teams_df):
+    ## Team rows are stored as uint8, so a field can have at most 255 teams
+    if bracket.n_teams > np.iinfo(np.uint8).max:
+        raise ValueError(f'{bracket.n_teams} teams do not fit in a uint8 outcomes store')
+
+    store = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.uint8, shape = (num_sims, bracket.n_games))
+    del store
+
+    lefts, rights = bracket.flat_games()
+    metadata = {
+        'num_sims' : num_sims,
+        'teams' : teams_df['Team'].tolist(),
+        'round_names' : bracket.round_names,
+        'round_offsets' : bracket.round_offsets().tolist(),
+        'game_lefts' : lefts.tolist(),
+        'game_rights' : rights.tolist(),
+    }
+    with open(metadata_path(path), 'w') as file:
+        json.dump(metadata, file)
+
+def write_outcomes(outcomes_store, outcomes):
+    ## outcomes_store is (path, first row) - called from worker processes, each writing its own rows
+    path, start = outcomes_store
+    store = np.load(path, mmap_mode = 'r+')
+    store[start:start + len(outcomes)] = outcomes
+    store.flush()
+
+def load_outcomes(path):
+    ## (num_sims x games) read-only memmap of winning team rows, games numbered round by round, and its metadata
+    with open(metadata_path(path)) as file:
+        metadata = json.load(file)
+    return np.load(path, mmap_mode = 'r'), metadata
+
+def iter_outcome_chunks(path, chunk_size = 1_000_000):
+    ## Scan a store a chunk of simulations at a time
+    outcomes, _ = load_outcomes(path)
+    for start in range(0, len(outcomes), chunk_size):
+        yield np.asarray(outcomes[start:start + chunk_size])
@@ -0,0 +1,125 @@
+## Run instrumentation for NCAA_simulation - per-phase wall time, counters, and an opt-in profiler that writes
+## pstats plus a collapsed-stack file (one 'frame;frame;frame count' line per stack) for flamegraph tools
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+PHASES = ['setup', 'probabilities', 'sampling', 'aggregation', 'io']
+SAMPLE_INTERVAL = 0.001
+
+## Running peak of every open phase while profile_run owns tracemalloc, innermost last - a phase resets the traced
+## peak when it starts, so it folds the peak so far into the phases around it first
+_phase_peaks = None
+
+class Instrumentation:
+
+    def __init__(self) -> None:
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        ## Phases can be entered many times (e.g. once per chunk), their times add up
+        ## Under profile_run the phase's peak allocation is counted too. Tracing started by anyone else (e.g. the
+        ## benchmark's peak memory run) is left alone, since counting a phase's peak means resetting the global one.
+        tracing = _phase_peaks is not None and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if _phase_peaks:
+                _phase_peaks[-1] = max(_phase_peaks[-1], peak)
+            tracemalloc.reset_peak()
+            _phase_peaks.append(current)
+            start_bytes = current
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
+            if tracing:
+                peak = max(_phase_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if _phase_peaks:
+                    _phase_peaks[-1] = max(_phase_peaks[-1], peak)
+                self.count(f'{name} peak bytes', peak - start_bytes)
+
+    def count(self, name, amount = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        self.timings = {}
+        self.counters = {}
+
+    def report(self):
+        total = sum(self.timings.values())
+        width = max(map(len, [*self.timings, *self.counters, ''])) + 2
+        lines = []
+        for name in PHASES + [name for name in self.timings if name not in PHASES]:
+            if name in self.timings:
+                seconds = self.timings[name]
+                lines.append(f'{name:<{width}}{seconds:>14.4f}s {100 * seconds / max(total, 1e-12):>6.1f}%')
+        for name, value in self.counters.items():
+            lines.append(f'{name:<{width}}{value:>15,}')
+        return '\n'.join(lines)
+
+class StackSampler:
+
+    def __init__(self, interval = SAMPLE_INTERVAL) -> None:
+        ## Samples the calling thread's Python stack every interval seconds from a background thread
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = None
+        self.running = False
+        self.thread = None
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.running = True
+        self.thread = threading.Thread(target = self.sample, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+def profile_run(func, output_prefix):
+    ## Runs func() under cProfile, the stack sampler and tracemalloc, writing <prefix>.pstats and <prefix>.collapsed
+    ## Only the calling process is profiled - blocks farmed out to worker processes show up as pool waits
+    import cProfile
+    global _phase_peaks
+    profiler = cProfile.Profile()
+    sampler = StackSampler()
+    tracemalloc.start()
+    _phase_peaks = []
+    sampler.start()
+    profiler.enable()
+    try:
+        result = func()
+    finally:
+        profiler.disable()
+        sampler.stop()
+        _phase_peaks = None
+        tracemalloc.stop()
+    profiler.dump_stats(f'{output_prefix}.pstats')
+    sampler.write_collapsed(f'{output_prefix}.collapsed')
+    return result
@@ -0,0 +1,77 @@
+## Loads and validates a ratings file (e.g. MM23_Sagarin.csv) and compiles its bracket once
+## The typed team table and compiled bracket are cached on disk keyed by a hash of the file and bracket config,
+## so reloading an unchanged file skips parsing, validation and compilation
+
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from bracket_compiler import load_bracket_config, compile_bracket
+
+RATINGS_COLUMNS = {'Region' : str, 'Seed' : np.int64, 'Team' : str, 'Sagarin rating' : np.float64}
+CACHE_DIR_NAME = '.ratings_cache'
+## Part of every cache key - bump it whenever the cached (teams_df, CompiledBracket) layout changes
+CACHE_VERSION = 1
+
+def validate_ratings(teams_df, source = 'ratings file'):
+    missing = [column for column in RATINGS_COLUMNS if column not in teams_df.columns]
+    if missing:
+        raise ValueError(f'{source} is missing columns {missing}')
+    if teams_df[list(RATINGS_COLUMNS)].isna().any().any():
+        rows = teams_df.index[teams_df[list(RATINGS_COLUMNS)].isna().any(axis = 1)].tolist()
+        raise ValueError(f'{source} has blank values in rows {rows}')
+
+    ratings = pd.to_numeric(teams_df['Sagarin rating'], errors = 'coerce')
+    if not np.isfinite(ratings).all():
+        raise ValueError(f'{source} has non-numeric ratings for {teams_df.loc[~np.isfinite(ratings), "Team"].tolist()}')
+    seeds = pd.to_numeric(teams_df['Seed'], errors = 'coerce')
+    bad_seeds = seeds.isna() | (seeds != seeds.round()) | (seeds < 1)
+    if bad_seeds.any():
+        raise ValueError(f'{source} has invalid seeds for {teams_df.loc[bad_seeds, "Team"].tolist()}')
+
+    duplicates = teams_df['Team'][teams_df['Team'].duplicated()].tolist()
+    if duplicates:
+        raise ValueError(f'{source} lists {duplicates} more than once')
+
+    ## Typed, position-indexed table - team i is row i everywhere in the engines
+    typed = teams_df.reset_index(drop = True).copy()
+    for column, dtype in RATINGS_COLUMNS.items():
+        typed[column] = typed[column].astype(dtype)
+    return typed
+
+def file_key(path, bracket_config):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        digest.update(file.read())
+    digest.update(json.dumps(bracket_config, sort_keys = True).encode())
+    ## Pickles are only readable by the code that wrote them, so the format and library versions are keyed too
+    digest.update(f'{CACHE_VERSION} {pd.__version__} {np.__version__}'.encode())
+    return digest.hexdigest()
+
+def load_ratings(path, bracket = None, cache_dir = None):
+    ## Returns (teams_df, compiled bracket) - bad input raises ValueError before any simulation starts
+    bracket_config = load_bracket_config(bracket)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+    cache_path = os.path.join(cache_dir, file_key(path, bracket_config) + '.pkl')
+
+    ## A cache file that can't be read back (truncated, or pickled by incompatible code) is rebuilt like a miss
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as file:
+                return pickle.load(file)
+        except Exception:
+            pass
+
+    teams_df = validate_ratings(pd.read_csv(path), os.path.basename(path))
+    compiled = compile_bracket(bracket_config, teams_df)
+
+    ## Write then rename, so a concurrent reader never sees a half written cache file
+    os.makedirs(cache_dir, exist_ok = True)
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as file:
+        pickle.dump((teams_df, compiled), file)
+    os.replace(temp_path, cache_path)
+    return teams_df, compiled